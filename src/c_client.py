@@ -1,10 +1,23 @@
 #!/usr/bin/env python
 from __future__ import print_function
 import getopt
+import hashlib
+import io
+import json
+import multiprocessing
 import os
+import pickle
 import sys
 import errno
+import filecmp
+import fnmatch
+import functools
 import re
+import shutil
+import tempfile
+import time
+import traceback
+from xml.etree import ElementTree
 
 # Jump to the bottom of this file for the main routine
 
@@ -22,34 +35,170 @@ _cplusplus_annoyances = {'class' : '_class',
                          'delete': '_delete'}
 _c_keywords = {'default' : '_default'}
 
-_hlines = []
-_hlevel = 0
-_clines = []
-_clevel = 0
 _ns = None
 
-# global variable to keep track of serializers and
-# switch data types due to weird dependencies
-finished_serializers = []
-finished_sizeof = []
-finished_switch = []
+# The GenContext of the module that is currently being generated
+_ctx = None
 
-# keeps enum objects so that we can refer to them when generating manpages.
-enums = {}
+def _profile_element(args):
+    '''
+    Returns the name of the protocol element a profiled function works on:
+    the name of its first argument that is an xcbgen type.
+    '''
+    for arg in args:
+        name = getattr(arg, 'name', None)
+        if isinstance(name, tuple):
+            return '.'.join(name)
+    return ''
+
+class Profiler(object):
+    '''
+    Collects wall time, number of calls and the number of emitted lines and
+    bytes per profiled function and protocol element.  Times are inclusive,
+    i.e. those of c_request contain those of _c_request_helper.
+    '''
+    def __init__(self):
+        # (function, element) -> [calls, seconds, lines, bytes]
+        self.records = {}
+        self.active = set()
+
+    def call(self, func, args, kwargs):
+        key = (func.__name__, _profile_element(args))
+        record = self.records.get(key)
+        if record is None:
+            record = self.records[key] = [0, 0.0, 0, 0]
+        record[0] += 1
+        if key in self.active:
+            # Recursive call, already accounted for by the outer one
+            return func(*args, **kwargs)
+
+        self.active.add(key)
+        (lines, size) = _ctx.emitted()
+        start = time.time()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            record[1] += time.time() - start
+            (end_lines, end_size) = _ctx.emitted()
+            record[2] += end_lines - lines
+            record[3] += end_size - size
+            self.active.discard(key)
+
+def _profiled(func):
+    '''
+    Decorator for output handlers and internal passes that are timed
+    when the profile option is set.
+    '''
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if _ctx.profiler is None:
+            return func(*args, **kwargs)
+        return _ctx.profiler.call(func, args, kwargs)
+    return wrapper
+
+def _function_group(func):
+    '''
+    Decorator for the output handlers of protocol elements: all C functions
+    generated for one element form a group, which is kept together when
+    the source file is sharded.
+    '''
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        _ctx.function_group += 1
+        _ctx.element = _n(args[1])
+        return func(*args, **kwargs)
+    return wrapper
+
+def _header_category(category):
+    '''
+    Decorator: the header lines written by the function belong to
+    category, one of SplitHeaderWriter.categories.
+    '''
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            previous = _ctx.header_category
+            _ctx.header_category = category
+            try:
+                return func(*args, **kwargs)
+            finally:
+                _ctx.header_category = previous
+        return wrapper
+    return decorator
+
+def _c_function(name, kind):
+    '''
+    Starts the definition of the C function (or variable) name in the
+    source file.  kind is one of 'global', 'request', 'reply', 'serialize',
+    'unserialize', 'unpack', 'sizeof', 'iterator', 'accessor' and 'name'.
+    Writes the empty line before the definition, the public alias of the
+    hidden definition with the version_script option, and the hot or cold
+    attribute if the function is in the hot list.
+    '''
+    _ctx.cfile.select(kind)
+    if _ctx.symbol_report is not None:
+        _ctx.symbol_report.start(name, kind, _ctx.element)
+
+    _ctx.functions.append(name)
 
-manpaths = False
+    _c('')
+    if _ctx.version_script:
+        _c('XCB_HIDDEN_ALIAS(%s)', name)
+    if _ctx.hot_list is not None and kind != 'global':
+        temperature = _hot_list_lookup(name)
+        if temperature is not None:
+            _c('XCB_%s', temperature.upper())
+
+    # Temporaries are numbered per function, so that adding a function
+    # does not change the code of all functions after it
+    _ctx.c_pre.tempvar_num = 0
+
+def _hot_list_lookup(name):
+    '''
+    Returns 'hot' or 'cold' if the function name matches an entry of the
+    hot list, None otherwise.  The first matching entry counts.
+    '''
+    for (pattern, temperature) in _ctx.hot_list:
+        if fnmatch.fnmatchcase(name, pattern):
+            return temperature
+    return None
 
 def _h(fmt, *args):
     '''
     Writes the given line to the header file.
     '''
-    _hlines[_hlevel].append(fmt % args)
+    _ctx.hfile.write_line(fmt % args)
+
+def _h_inline(ret, name, params, args, body):
+    '''
+    Writes a static inline copy of the function name to the header, and a
+    macro that makes calls use it unless XCB_NO_INLINE is defined.  The
+    exported function is still generated, for the ABI and for taking its
+    address.  params is the parameter list, args are the parameter names
+    and body the lines of the function body.
+    '''
+    if _ctx.header_only:
+        # all functions are inline already
+        return
+    _h('')
+    _h('#ifndef XCB_NO_INLINE')
+    _h('XCB_INLINE %s', ret)
+    _h('%s_inline (%s)', name, params)
+    _h('{')
+    for line in body:
+        _h('%s', line)
+    _h('}')
+    _h('#define %s(%s) %s_inline(%s)', name, ', '.join(args), name, ', '.join(args))
+    _h('#endif')
 
 def _c(fmt, *args):
     '''
     Writes the given line to the source file.
     '''
-    _clines[_clevel].append(fmt % args)
+    line = fmt % args
+    _ctx.cfile.write_line(line)
+    if _ctx.symbol_report is not None:
+        _ctx.symbol_report.add_line(line)
 
 def _hc(fmt, *args):
     '''
@@ -58,6 +207,630 @@ def _hc(fmt, *args):
     _h(fmt, *args)
     _c(fmt, *args)
 
+def _write_if_changed(name, data):
+    '''
+    Writes data to the generated file name (relative to the output directory),
+    unless the file already has exactly this content.  Unchanged files keep
+    their timestamp, so nothing that depends on them gets rebuilt.
+
+    The data is written to a temporary file first, which then replaces the
+    file, so the file is never missing or left half written.
+    '''
+    path = os.path.join(_ctx.outdir, name)
+    _ctx.outputs.append(name)
+    try:
+        with open(path) as f:
+            if f.read() == data:
+                return
+    except IOError:
+        pass
+    tmp_path = path + '.tmp'
+    try:
+        with open(tmp_path, 'w') as f:
+            f.write(data)
+        # os.rename() replaces atomically, but not on Windows
+        getattr(os, 'replace', os.rename)(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+class OutputFile(object):
+    '''
+    File-like object for a generated file.  The content is collected in
+    memory and handed to _write_if_changed() on close().  If batch is a
+    list, (name, content) is appended to it instead, to be written later.
+    '''
+    def __init__(self, name, batch=None):
+        self.name = name
+        self.parts = []
+        self.batch = batch
+
+    def write(self, data):
+        self.parts.append(data)
+        _ctx.man_lines += data.count('\n')
+        _ctx.man_bytes += len(data)
+
+    def close(self):
+        if self.batch is not None:
+            self.batch.append((self.name, ''.join(self.parts)))
+        else:
+            _write_if_changed(self.name, ''.join(self.parts))
+
+class _Section(object):
+    '''
+    One section of a SectionWriter: buffered lines plus the file
+    the buffer is flushed to.
+    '''
+    def __init__(self, spool):
+        self.parts = []
+        self.size = 0
+        self.spool = spool
+
+    def flush(self):
+        if self.parts:
+            self.spool.write(''.join(self.parts))
+            self.parts = []
+            self.size = 0
+
+class SectionWriter(object):
+    '''
+    Writes a generated file that consists of several sections (levels).
+    Lines can be added to any section at any time, the sections end up in
+    the file in ascending order.
+
+    Lines are buffered and flushed in large blocks.  Section 0 is streamed
+    straight into a temporary file next to the target, the other sections
+    are spooled to anonymous temporary files and appended on close().
+    The target is only replaced if its content changed.
+    '''
+    block_size = 1 << 16
+
+    def __init__(self, name):
+        self.name = name
+        self.path = os.path.join(_ctx.outdir, name)
+        self.tmp_path = self.path + '.tmp'
+        self.sections = [_Section(open(self.tmp_path, 'w'))]
+        _ctx.writers.append(self)
+        self.current = self.sections[0]
+        self.lines = 0
+        self.bytes = 0
+
+    def select(self, kind):
+        pass
+
+    def setlevel(self, idx):
+        while len(self.sections) <= idx:
+            self.sections.append(_Section(tempfile.TemporaryFile('w+')))
+        self.current = self.sections[idx]
+
+    def write_line(self, line):
+        section = self.current
+        section.parts.append(line)
+        section.parts.append('\n')
+        section.size += len(line) + 1
+        self.lines += 1
+        self.bytes += len(line) + 1
+        if section.size >= self.block_size:
+            section.flush()
+
+    def close(self):
+        out = self.sections[0]
+        out.flush()
+        for section in self.sections[1:]:
+            section.flush()
+            section.spool.seek(0)
+            shutil.copyfileobj(section.spool, out.spool, self.block_size)
+            section.spool.close()
+        out.spool.close()
+        self.sections = []
+        _replace_if_changed(self.tmp_path, self.name)
+
+    def discard(self):
+        for section in self.sections:
+            section.spool.close()
+        self.sections = []
+        if os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
+
+class NullWriter(object):
+    '''
+    Stands in for a SectionWriter if the file is not wanted: drops all
+    lines.
+    '''
+    lines = 0
+    bytes = 0
+
+    def select(self, kind):
+        pass
+
+    def setlevel(self, idx):
+        pass
+
+    def write_line(self, line):
+        pass
+
+    def close(self):
+        pass
+
+    def discard(self):
+        pass
+
+class ShardedWriter(object):
+    '''
+    Writes the source file of a module as several translation units that
+    can be compiled in parallel.  The includes and macros of the source
+    file (section 0) go to the private header <header>_priv.h, which is
+    included by all shards.  The functions are distributed over the shards
+    as announced by _c_function():
+
+    shards = N:      <header>.c, <header>_1.c, ... <header>_<N-1>.c; the
+                     functions generated for a protocol element go to the
+                     shard that has the least code so far
+    shards = 'kind': <header>.c for requests and replies,
+                     <header>_serialize.c for the serializers and
+                     <header>_accessors.c for iterators and accessors
+
+    The extension global is always defined in <header>.c.
+    '''
+    kinds = {'serialize' : 1,
+             'unserialize' : 1,
+             'unpack' : 1,
+             'sizeof' : 1,
+             'iterator' : 2,
+             'accessor' : 2}
+
+    def __init__(self, header, shards):
+        self.by_kind = (shards == 'kind')
+        if self.by_kind:
+            names = [header, header + '_serialize', header + '_accessors']
+        else:
+            names = [header] + ['%s_%d' % (header, i) for i in range(1, shards)]
+
+        self.priv_name = '%s_priv.h' % header
+        self.priv = SectionWriter(self.priv_name)
+        self.priv.write_line('#ifndef __%s_PRIV_H' % header.upper())
+        self.priv.write_line('#define __%s_PRIV_H' % header.upper())
+        self.priv.write_line('')
+
+        self.shards = []
+        for name in names:
+            shard = SectionWriter(name + '.c')
+            shard.write_line('/*')
+            shard.write_line(' * This file generated automatically from %s by c_client.py.' %
+                             os.path.basename(_ns.file))
+            shard.write_line(' * Edit at your peril.')
+            shard.write_line(' */')
+            shard.write_line('')
+            shard.write_line('#include "%s"' % self.priv_name)
+            self.shards.append(shard)
+
+        self.level = 0
+        self.current = self.shards[0]
+        self.function_group = None
+
+    @property
+    def lines(self):
+        return sum(w.lines for w in [self.priv] + self.shards)
+
+    @property
+    def bytes(self):
+        return sum(w.bytes for w in [self.priv] + self.shards)
+
+    def select(self, kind):
+        if self.by_kind:
+            self.current = self.shards[self.kinds.get(kind, 0)]
+        elif kind == 'global':
+            self.current = self.shards[0]
+        elif _ctx.function_group != self.function_group:
+            self.function_group = _ctx.function_group
+            self.current = min(self.shards, key=lambda shard: shard.bytes)
+        self.current.setlevel(max(self.level, 1))
+
+    def setlevel(self, idx):
+        self.level = idx
+        if idx == 0:
+            self.priv.setlevel(0)
+        else:
+            self.current.setlevel(idx)
+
+    def write_line(self, line):
+        if self.level == 0:
+            self.priv.write_line(line)
+        else:
+            self.current.write_line(line)
+
+    def close(self):
+        self.priv.setlevel(1)
+        self.priv.write_line('')
+        self.priv.write_line('#endif')
+        for writer in [self.priv] + self.shards:
+            writer.close()
+
+    def discard(self):
+        for writer in [self.priv] + self.shards:
+            writer.discard()
+
+class LeanHeaderWriter(object):
+    '''
+    Writes a header twice: the documented version to <header>-doc.h, and
+    a lean version without any Doxygen comments to <header>.h, to keep
+    preprocessing cheap for everything that includes it.  Runs of empty
+    lines left over from the comments are collapsed.
+    '''
+    member_doc_re = re.compile(r'\s*/\*\*<.*?\*/\s*', re.DOTALL)
+
+    def __init__(self, header):
+        self.doc = SectionWriter('%s-doc.h' % header)
+        self.lean = SectionWriter('%s.h' % header)
+        self.in_doc = False
+        # last line written to each section of the lean header was empty
+        self.blank = {}
+        self.level = 0
+
+    @property
+    def lines(self):
+        return self.doc.lines + self.lean.lines
+
+    @property
+    def bytes(self):
+        return self.doc.bytes + self.lean.bytes
+
+    def select(self, kind):
+        pass
+
+    def setlevel(self, idx):
+        self.level = idx
+        self.doc.setlevel(idx)
+        self.lean.setlevel(idx)
+
+    def write_line(self, line):
+        self.doc.write_line(line)
+
+        if self.in_doc:
+            self.in_doc = not line.rstrip().endswith('*/')
+            return
+        if line.startswith('/**'):
+            self.in_doc = not line.rstrip().endswith('*/')
+            return
+
+        line = self.member_doc_re.sub('', line) if '/**<' in line else line
+        blank = (line.strip() == '')
+        if blank and self.blank.get(self.level, False):
+            return
+        self.blank[self.level] = blank
+        self.lean.write_line(line)
+
+    def close(self):
+        self.doc.close()
+        self.lean.close()
+
+    def discard(self):
+        self.doc.discard()
+        self.lean.discard()
+
+def _header_writer(header):
+    '''
+    Returns the writer for the header file <header>.h.
+    '''
+    if _ctx.lean_headers:
+        return LeanHeaderWriter(header)
+    return SectionWriter('%s.h' % header)
+
+class SplitHeaderWriter(object):
+    '''
+    Writes the header of a module as one header per category:
+    <header>_types.h, <header>_events.h, <header>_errors.h,
+    <header>_requests.h and <header>_accessors.h, each including the one
+    before it.  The lines go to the header of the category of the output
+    handler that writes them, see _header_category().  Everything else
+    (the preamble of c_open and the end of c_close) goes to <header>.h,
+    which includes all category headers.
+
+    The category headers include neither xcb.h nor the headers of the
+    imported modules, which include all of xproto.h.  <header>_types.h
+    includes xcb_base.h and the types headers of the imported modules,
+    which are generated split as well.
+    '''
+    categories = ['types', 'events', 'errors', 'requests', 'accessors']
+
+    def __init__(self, header, imports):
+        self.header = header
+        self.umbrella = _header_writer(header)
+        self.writers = {}
+        previous = None
+        for category in self.categories:
+            name = '%s_%s' % (header, category)
+            writer = self.writers[category] = _header_writer(name)
+            writer.write_line('/*')
+            writer.write_line(' * This file generated automatically from %s by c_client.py.' %
+                              os.path.basename(_ns.file))
+            writer.write_line(' * Edit at your peril.')
+            writer.write_line(' */')
+            writer.write_line('')
+            writer.write_line('#ifndef __%s_H' % name.upper())
+            writer.write_line('#define __%s_H' % name.upper())
+            writer.write_line('')
+            if previous is None:
+                writer.write_line('#include "xcb_base.h"')
+                for h in imports:
+                    writer.write_line('#include "%s_types.h"' % h)
+            else:
+                writer.write_line('#include "%s.h"' % previous)
+            writer.write_line('')
+            writer.write_line('#ifdef __cplusplus')
+            writer.write_line('extern "C" {')
+            writer.write_line('#endif')
+            previous = name
+        self.level = 0
+
+    @property
+    def lines(self):
+        return sum(w.lines for w in [self.umbrella] + list(self.writers.values()))
+
+    @property
+    def bytes(self):
+        return sum(w.bytes for w in [self.umbrella] + list(self.writers.values()))
+
+    def select(self, kind):
+        pass
+
+    def setlevel(self, idx):
+        self.level = idx
+
+    def write_line(self, line):
+        writer = self.writers.get(_ctx.header_category, self.umbrella)
+        writer.setlevel(self.level)
+        writer.write_line(line)
+
+    def close(self):
+        self.umbrella.setlevel(1)
+        self.umbrella.write_line('')
+        for category in self.categories:
+            self.umbrella.write_line('#include "%s_%s.h"' % (self.header, category))
+        for category in self.categories:
+            writer = self.writers[category]
+            writer.setlevel(2)
+            writer.write_line('')
+            writer.write_line('#ifdef __cplusplus')
+            writer.write_line('}')
+            writer.write_line('#endif')
+            writer.write_line('')
+            writer.write_line('#endif')
+        for writer in [self.umbrella] + [self.writers[c] for c in self.categories]:
+            writer.close()
+
+    def discard(self):
+        for writer in [self.umbrella] + list(self.writers.values()):
+            writer.discard()
+
+class HeaderOnlyWriter(object):
+    '''
+    Writes the header and the source file of a module into one header,
+    for applications that compile the protocol code into their own
+    translation units.  The functions are defined static inline in the
+    header.  The translation unit that defines XCB_<HEADER>_IMPLEMENTATION
+    gets exported definitions instead, plus the extension global and the
+    name tables (the kinds in impl_kinds), which exist only once.
+
+    Sections of the header: 0 and 1 as in a header, 2 the preamble of the
+    implementation, 3 and 4 the sections 1 and 2 of the source file, and
+    5 the end of the header.  Section 0 of the source file (its includes
+    and macros) is replaced by the preamble.
+
+    The storage class macro is put in front of the first line of every
+    prototype and definition, i.e. the first non-empty line written to
+    the header or source after _c_function().
+    '''
+    impl_kinds = ('global', 'name')
+    header_sections = {0 : 0, 1 : 1, 2 : 5}
+    source_sections = {1 : 3, 2 : 4}
+
+    def __init__(self, header):
+        self.writer = _header_writer(header)
+        self.implementation = 'XCB_%s_IMPLEMENTATION' % header.upper()
+        self.storage = 'XCB_%s_FUNCTION' % header.upper()
+        self.source = _HeaderOnlySource(self)
+        self.level = 0
+        # prefix the next prototype or definition with the storage class
+        self.prefix_header = False
+        self.prefix_source = False
+        # section of the open #ifdef of the implementation, or None
+        self.impl_section = None
+
+        self.writer.setlevel(1)
+        self.writer.write_line('')
+        self.writer.write_line('#ifdef %s' % self.implementation)
+        self.writer.write_line('#define %s' % self.storage)
+        self.writer.write_line('#else')
+        self.writer.write_line('#define %s XCB_INLINE' % self.storage)
+        self.writer.write_line('#endif')
+
+        self.writer.setlevel(2)
+        for line in ['',
+                     '#ifdef __cplusplus',
+                     '}',
+                     '#endif',
+                     '',
+                     '#include <stdlib.h>',
+                     '#include <string.h>',
+                     '#include <assert.h>',
+                     '#include <stddef.h>  /* for offsetof() */',
+                     '#include "xcbext.h"',
+                     '',
+                     '#ifdef __cplusplus',
+                     'extern "C" {',
+                     '#endif',
+                     '',
+                     '#ifndef ALIGNOF',
+                     '#define ALIGNOF(type) offsetof(struct { char dummy; type member; }, member)',
+                     '#endif']:
+            self.writer.write_line(line)
+        if _ctx.hot_list is not None:
+            for line in _hot_macros:
+                self.writer.write_line(line)
+        self.writer.setlevel(0)
+
+    @property
+    def lines(self):
+        return self.writer.lines
+
+    @property
+    def bytes(self):
+        return self.writer.bytes
+
+    def select(self, kind):
+        '''
+        Called by _c_function() through the source.
+        '''
+        impl = kind in self.impl_kinds
+        section = self.source_sections.get(self.source.level, 3)
+        if impl and self.impl_section is None:
+            self.writer.setlevel(section)
+            self.writer.write_line('')
+            self.writer.write_line('#ifdef %s' % self.implementation)
+            self.impl_section = section
+        elif not impl and self.impl_section is not None:
+            self._end_impl()
+        self.prefix_header = not impl
+        self.prefix_source = not impl
+
+    def _end_impl(self):
+        self.writer.setlevel(self.impl_section)
+        self.writer.write_line('')
+        self.writer.write_line('#endif')
+        self.impl_section = None
+
+    def setlevel(self, idx):
+        self.level = idx
+
+    def write_line(self, line):
+        self.writer.setlevel(self.header_sections[self.level])
+        if self.prefix_header and self.level == 1 and line:
+            self.prefix_header = False
+            line = '%s %s' % (self.storage, line)
+        self.writer.write_line(line)
+
+    def write_source_line(self, level, line):
+        if level == 0:
+            return
+        self.writer.setlevel(self.source_sections[level])
+        if self.prefix_source and line:
+            self.prefix_source = False
+            line = '%s %s' % (self.storage, line)
+        self.writer.write_line(line)
+
+    def close(self):
+        if self.impl_section is not None:
+            self._end_impl()
+        self.writer.close()
+
+    def discard(self):
+        self.writer.discard()
+
+class _HeaderOnlySource(object):
+    '''
+    The source file of a HeaderOnlyWriter.
+    '''
+    def __init__(self, owner):
+        self.owner = owner
+        self.level = 0
+
+    lines = 0
+    bytes = 0
+
+    def select(self, kind):
+        self.owner.select(kind)
+
+    def setlevel(self, idx):
+        self.level = idx
+
+    def write_line(self, line):
+        self.owner.write_source_line(self.level, line)
+
+    def close(self):
+        pass
+
+    def discard(self):
+        pass
+
+class SymbolReport(object):
+    '''
+    Collects the C functions written to the source file of a module, with
+    their kind, protocol element, number of lines and cost class:
+
+    constant:    runs in constant time
+    walk:        walks a list, itself or in a generated function it calls
+                 (e.g. the _end() of a preceding variable-size list)
+    unserialize: calls an _unserialize() or _unpack() function
+    '''
+    costs = ['constant', 'walk', 'unserialize']
+    loop_re = re.compile(r'\b(for|while)\s*\(')
+    call_re = re.compile(r'\b(xcb_\w+)\s*\(')
+
+    def __init__(self):
+        # name -> [kind, element, lines, cost, called names]
+        self.functions = {}
+        self.order = []
+        self.current = None
+
+    def start(self, name, kind, element):
+        self.current = self.functions[name] = [kind, element, 0, 0, set()]
+        self.order.append(name)
+
+    def stop(self):
+        '''
+        Ends the current function, the following lines are not counted
+        until the next start().
+        '''
+        self.current = None
+
+    def add_line(self, line):
+        function = self.current
+        if function is None:
+            return
+        function[2] += 1
+        if self.loop_re.search(line):
+            function[3] = max(function[3], 1)
+        for called in self.call_re.findall(line):
+            if called.endswith('_unserialize') or called.endswith('_unpack'):
+                function[3] = 2
+            function[4].add(called)
+
+    def write(self, name):
+        '''
+        Writes the report as tab separated file, to be joined with the
+        symbol sizes from nm -S.
+        '''
+        # a function costs at least as much as the functions it calls
+        changed = True
+        while changed:
+            changed = False
+            for function in self.functions.values():
+                for called in function[4]:
+                    if called in self.functions and self.functions[called][3] > function[3]:
+                        function[3] = self.functions[called][3]
+                        changed = True
+
+        lines = ['# symbol\tkind\telement\tlines\tcost\n']
+        for symbol in self.order:
+            (kind, element, count, cost, called) = self.functions[symbol]
+            lines.append('%s\t%s\t%s\t%d\t%s\n' % (symbol, kind, element, count, self.costs[cost]))
+        _write_if_changed(name, ''.join(lines))
+
+def _replace_if_changed(tmp_path, name):
+    '''
+    Moves the file tmp_path to the generated file name (relative to the
+    output directory), unless that already has exactly the same content.
+    '''
+    path = os.path.join(_ctx.outdir, name)
+    _ctx.outputs.append(name)
+    if os.path.exists(path) and filecmp.cmp(tmp_path, path, shallow=False):
+        os.remove(tmp_path)
+        return
+    # os.rename() replaces atomically, but not on Windows
+    getattr(os, 'replace', os.rename)(tmp_path, path)
+
 def _c_wr_stringlist(indent, strlist):
     '''
     Writes the given list of strings to the source file.
@@ -155,42 +928,151 @@ class PreCode(object):
         self.redirect_code = None
         self.redirect_tempvars = None
 
-# global PreCode handler
-_c_pre = PreCode()
+
+class GenContext(object):
+    '''
+    Holds the state of the generation of a single module: the output line
+    sections, the pre-code handler, the registries of already generated
+    functions and the options the module is generated with.
+    A new context is used for every module, so no state leaks from one
+    module to the next.
+    '''
+    def __init__(self, outdir, options):
+        self.outdir = outdir
+        self.center_footer = options['center_footer']
+        self.left_footer = options['left_footer']
+        self.section = options['section']
+        self.manpaths = options['manpaths']
+        self.man = options['man']
+        self.shards = options['shards']
+        self.only = options['only']
+        self.hot_list = options['hot_list']
+        self.lean_headers = options['lean_headers']
+        self.split_headers = options['split_headers']
+        self.version_script = options['version_script']
+        self.name_tables = options['name_tables']
+        self.list_index = options['list_index']
+        self.header_only_modules = options['header_only']
+        # the current module is generated by HeaderOnlyWriter, see c_open()
+        self.header_only = False
+
+        self.module = None
+
+        # SectionWriters of the header and source file
+        self.hfile = None
+        self.cfile = None
+        # all SectionWriters opened, discarded if generating fails
+        self.writers = []
+
+        # see _header_category()
+        self.header_category = None
+
+        # counts the protocol elements, see _function_group(), and the C
+        # name of the current one
+        self.function_group = 0
+        self.element = ''
+
+        # all functions and variables defined in the source file, see
+        # _c_function()
+        self.functions = []
+
+        # with the name_tables option: kind -> {number: name} of requests,
+        # events, generic events and errors, see _c_opcode(), and
+        # (type name, [(value, name)]) of the enums, see c_enum()
+        self.names = {'request' : {}, 'event' : {}, 'ge_event' : {}, 'error' : {}}
+        self.enum_names = []
+
+        # SymbolReport if the symbol_report option is set
+        self.symbol_report = SymbolReport() if options['symbol_report'] else None
+
+        # PreCode handler
+        self.c_pre = PreCode()
+
+        # keep track of serializers and switch data types
+        # due to weird dependencies
+        self.finished_serializers = set()
+        self.finished_sizeof = set()
+        self.finished_switch = set()
+
+        # type -> (name, postfix) it was last set up with, see _c_type_setup
+        self.finished_type_setup = {}
+
+        # keeps enum objects so that we can refer to them when generating manpages.
+        self.enums = {}
+
+        # type-name collision avoidance table used by c_enum
+        self.namecount = {}
+        # C names of the types and protocol elements of the module, see
+        # _c_name_taken()
+        self.element_names = set()
+
+        # man page paths, collected when manpaths is set
+        self.manpath_list = []
+
+        # with man 'only': (name, content) of all man pages, written by
+        # c_close, and (alias page, target page) of the alias pages
+        self.man_pages = []
+        self.man_aliases = []
+
+        # all files generated for the module, relative to outdir
+        self.outputs = []
+
+        # Profiler if the generation is profiled, see generate()
+        self.profiler = None
+        self.man_lines = 0
+        self.man_bytes = 0
+
+    def emitted(self):
+        '''
+        Returns the number of lines and bytes written so far.
+        '''
+        lines = self.man_lines
+        size = self.man_bytes
+        for writer in (self.hfile, self.cfile):
+            if writer is not None:
+                lines += writer.lines
+                size += writer.bytes
+        return (lines, size)
 
 
 # XXX See if this level thing is really necessary.
 def _h_setlevel(idx):
     '''
-    Changes the array that header lines are written to.
+    Changes the section that header lines are written to.
     Supports writing different sections of the header file.
     '''
-    global _hlevel
-    while len(_hlines) <= idx:
-        _hlines.append([])
-    _hlevel = idx
+    _ctx.hfile.setlevel(idx)
 
 def _c_setlevel(idx):
     '''
-    Changes the array that source lines are written to.
+    Changes the section that source lines are written to.
     Supports writing to different sections of the source file.
     '''
-    global _clevel
-    while len(_clines) <= idx:
-        _clines.append([])
-    _clevel = idx
+    _ctx.cfile.setlevel(idx)
+
+# caches for the C-name conversion functions below
+_n_item_cache = {}
+_n_cache = {}
+_t_cache = {}
 
 def _n_item(str):
     '''
     Does C-name conversion on a single string fragment.
     Uses a regexp with some hard-coded special cases.
+    Results are memoized, the same fragments are converted over and over.
     '''
+    try:
+        return _n_item_cache[str]
+    except KeyError:
+        pass
     if str in _cname_special_cases:
-        return _cname_special_cases[str]
+        result = _cname_special_cases[str]
     else:
         split = _cname_re.finditer(str)
         name_parts = [match.group(0) for match in split]
-        return '_'.join(name_parts)
+        result = '_'.join(name_parts)
+    _n_item_cache[str] = result
+    return result
 
 def _cpp(str):
     '''
@@ -218,7 +1100,13 @@ def _n(list):
     Does C-name conversion on a tuple of strings.
     Different behavior depending on length of tuple, extension/not extension, etc.
     Basically C-name converts the individual pieces, then joins with underscores.
+    Results are memoized per tuple and extension/not extension.
     '''
+    key = (_ns.is_ext, tuple(list))
+    try:
+        return _n_cache[key]
+    except KeyError:
+        pass
     if len(list) == 1:
         parts = list
     elif len(list) == 2:
@@ -227,13 +1115,19 @@ def _n(list):
         parts = [list[0], _ext(list[1])] + [_n_item(i) for i in list[2:]]
     else:
         parts = [list[0]] + [_n_item(i) for i in list[1:]]
-    return '_'.join(parts).lower()
+    result = _n_cache[key] = '_'.join(parts).lower()
+    return result
 
 def _t(list):
     '''
     Does C-name conversion on a tuple of strings representing a type.
     Same as _n but adds a "_t" on the end.
     '''
+    key = (_ns.is_ext, tuple(list))
+    try:
+        return _t_cache[key]
+    except KeyError:
+        pass
     if len(list) == 1:
         parts = list
     elif len(list) == 2:
@@ -242,9 +1136,22 @@ def _t(list):
         parts = [list[0], _ext(list[1])] + [_n_item(i) for i in list[2:]] + ['t']
     else:
         parts = [list[0]] + [_n_item(i) for i in list[1:]] + ['t']
-    return '_'.join(parts).lower()
-
-
+    result = _t_cache[key] = '_'.join(parts).lower()
+    return result
+
+
+# GCC puts hot functions into .text.hot and cold ones into .text.unlikely,
+# so that each group is kept together
+_hot_macros = ['',
+               '#if defined(__clang__) || (defined(__GNUC__) && (__GNUC__ > 4 || (__GNUC__ == 4 && __GNUC_MINOR__ >= 3)))',
+               '#define XCB_HOT __attribute__((__hot__))',
+               '#define XCB_COLD __attribute__((__cold__))',
+               '#else',
+               '#define XCB_HOT',
+               '#define XCB_COLD',
+               '#endif']
+
+@_profiled
 def c_open(self):
     '''
     Exported function that handles module open.
@@ -257,11 +1164,44 @@ def c_open(self):
     # Build the type-name collision avoidance table used by c_enum
     build_collision_table()
 
+    # The core protocol and modules that other modules import are kept
+    # whole: libxcb itself and the headers of the importing modules need
+    # their types, whatever subset of these is generated.
+    if _ctx.only is not None and _ns.is_ext and not _xml_is_imported(_ns.path):
+        select_subset(self, _ctx.only)
+
+    _ctx.header_only = _ctx.header_only_modules is not None and _ns.header in _ctx.header_only_modules
+    if _ctx.header_only and not _ns.is_ext:
+        # xcb.h includes xproto.h before it declares the connection and
+        # extension types that the inline functions use
+        raise Exception('the core protocol %s cannot be generated header-only' % _ns.header)
+    if _ctx.header_only:
+        # nothing is exported from a library
+        _ctx.version_script = False
+
+    if _ctx.man == 'only':
+        _ctx.hfile = NullWriter()
+        _ctx.cfile = NullWriter()
+    elif _ctx.header_only:
+        _ctx.hfile = HeaderOnlyWriter(_ns.header)
+        _ctx.cfile = _ctx.hfile.source
+    else:
+        if _ctx.split_headers:
+            imports = [h for (n, h) in self.direct_imports] if _ns.is_ext else []
+            _ctx.hfile = SplitHeaderWriter(_ns.header, imports)
+        else:
+            _ctx.hfile = _header_writer(_ns.header)
+        if _ctx.shards == 1:
+            _ctx.cfile = SectionWriter('%s.c' % _ns.header)
+        else:
+            _ctx.cfile = ShardedWriter(_ns.header, _ctx.shards)
+
     _h_setlevel(0)
     _c_setlevel(0)
 
     _hc('/*')
-    _hc(' * This file generated automatically from %s by c_client.py.', _ns.file)
+    # Only the base name, the output must not depend on where the XML is
+    _hc(' * This file generated automatically from %s by c_client.py.', os.path.basename(_ns.file))
     _hc(' * Edit at your peril.')
     _hc(' */')
     _hc('')
@@ -284,12 +1224,33 @@ def c_open(self):
     _c('#include <string.h>')
     _c('#include <assert.h>')
     _c('#include <stddef.h>  /* for offsetof() */')
+    _c('#ifndef XCB_NO_INLINE')
+    _c('#define XCB_NO_INLINE 1  /* define the exported functions, not the inline copies */')
+    _c('#endif')
     _c('#include "xcbext.h"')
     _c('#include "%s.h"', _ns.header)
 
     _c('')
     _c('#define ALIGNOF(type) offsetof(struct { char dummy; type member; }, member)')
 
+    if _ctx.hot_list is not None:
+        for line in _hot_macros:
+            _c('%s', line)
+
+    if _ctx.version_script and _ctx.man != 'only':
+        # Everything defined in the source file is defined under the
+        # hidden name <name>_internal, and <name> is an alias of it.  Calls
+        # within the library use the hidden name, so they neither go
+        # through the PLT nor need a dynamic relocation.
+        _c('')
+        _c('#if ((defined(__GNUC__) && __GNUC__ >= 4) || defined(__clang__)) && defined(__ELF__)')
+        _c('#define XCB_HIDDEN_PROTO(name) extern __typeof(name) name __asm__(#name "_internal") __attribute__((__visibility__("hidden")));')
+        _c('#define XCB_HIDDEN_ALIAS(name) extern __typeof(name) name##_public __asm__(#name) __attribute__((__alias__(#name "_internal"), __visibility__("default")));')
+        _c('#else')
+        _c('#define XCB_HIDDEN_PROTO(name)')
+        _c('#define XCB_HIDDEN_ALIAS(name)')
+        _c('#endif')
+
     if _ns.is_ext:
         for (n, h) in self.direct_imports:
             _hc('#include "%s.h"', h)
@@ -306,9 +1267,13 @@ def c_open(self):
         _h('') #XXX
         _h('extern xcb_extension_t %s;', _ns.c_ext_global_name)
 
-        _c('')
+        # the extension global is defined only once, even if sharded
+        _c_setlevel(1)
+        _c_function(_ns.c_ext_global_name, 'global')
         _c('xcb_extension_t %s = { "%s", 0 };', _ns.c_ext_global_name, _ns.ext_xname)
+        _c_setlevel(0)
 
+@_profiled
 def c_close(self):
     '''
     Exported function that handles module close.
@@ -318,6 +1283,9 @@ def c_close(self):
     _c_setlevel(2)
     _hc('')
 
+    if _ctx.name_tables and _ctx.man != 'only':
+        _c_name_tables()
+
     _h('')
     _h('#ifdef __cplusplus')
     _h('}')
@@ -330,39 +1298,316 @@ def c_close(self):
     _h(' * @}')
     _h(' */')
 
-    # Write header file
-    hfile = open('%s.h' % _ns.header, 'w')
-    for list in _hlines:
-        for line in list:
-            hfile.write(line)
-            hfile.write('\n')
-    hfile.close()
-
-    # Write source file
-    cfile = open('%s.c' % _ns.header, 'w')
-    for list in _clines:
-        for line in list:
-            cfile.write(line)
-            cfile.write('\n')
-    cfile.close()
+    if _ctx.version_script and _ctx.man != 'only':
+        # The hidden declarations have to come before the first use, i.e.
+        # at the end of section 0.  Written directly, so that they do not
+        # count for the last function in the symbol report.
+        _c_setlevel(0)
+        _ctx.cfile.write_line('')
+        for name in _ctx.functions:
+            _ctx.cfile.write_line('XCB_HIDDEN_PROTO(%s)' % name)
+        _c_setlevel(2)
+        # libxcb also contains the hand-written API, which a script of the
+        # core protocol would hide
+        if _ns.is_ext:
+            _write_version_script('%s.map' % _ns.header, _ctx.functions)
+
+    # Finish header and source file
+    _ctx.hfile.close()
+    _ctx.cfile.close()
+
+    if _ctx.symbol_report is not None and _ctx.man != 'only':
+        _ctx.symbol_report.write('%s.symbols' % _ns.header)
+
+    if _ctx.man == 'only':
+        _man_write_batch()
+
+def _c_name_table(function, ctype, param, doc, names, blob):
+    '''
+    Writes the lookup function for the names of one table.  names maps
+    numbers to names, blob the names to their offset in the name blob.
+    Dense tables are indexed by the number; sparse ones (enums with large
+    values, e.g. masks) are sorted by number and searched.
+    '''
+    numbers = sorted(n for n in names if 0 <= n <= 0xffffffff)
+    offsets_name = function + '_offsets'
+    numbers_name = function + '_numbers'
+    dense = not numbers or numbers[-1] < 4 * len(numbers) + 16
+    if dense:
+        offsets = [0] * (numbers[-1] + 1 if numbers else 0)
+        for n in numbers:
+            offsets[n] = blob[names[n]]
+    else:
+        offsets = [blob[names[n]] for n in numbers]
+
+    _h('')
+    _h('/**')
+    _h(' * @brief Returns the name of the %s %s, or NULL if there is none.', doc, param)
+    _h(' */')
+    _h('const char *')
+    _h('%s (%s %s);', function, ctype, param)
+
+    _ctx.cfile.select('name')
+    if _ctx.symbol_report is not None:
+        _ctx.symbol_report.stop()
+    if offsets:
+        _c('')
+        _c('static const %s %s[] = {', blob.ctype, offsets_name)
+        for i in range(0, len(offsets), 12):
+            _c('    %s,', ', '.join(str(o) for o in offsets[i:i + 12]))
+        _c('};')
+    if not dense:
+        _c('')
+        _c('static const uint32_t %s[] = {', numbers_name)
+        for i in range(0, len(numbers), 8):
+            _c('    %s,', ', '.join('%dU' % n for n in numbers[i:i + 8]))
+        _c('};')
+
+    _c_function(function, 'name')
+    _c('const char *')
+    _c('%s (%s %s)', function, ctype, param)
+    _c('{')
+    if not offsets:
+        _c('    (void) %s;', param)
+        _c('    return 0;')
+    elif dense:
+        _c('    if (%s >= %d || !%s[%s])', param, len(offsets), offsets_name, param)
+        _c('        return 0;')
+        _c('    return %s + %s[%s];', blob.name, offsets_name, param)
+    else:
+        _c('    unsigned int lo = 0;')
+        _c('    unsigned int hi = %d;', len(numbers))
+        _c('    while (lo < hi) {')
+        _c('        unsigned int mid = (lo + hi) / 2;')
+        _c('        if (%s[mid] < %s)', numbers_name, param)
+        _c('            lo = mid + 1;')
+        _c('        else')
+        _c('            hi = mid;')
+        _c('    }')
+        _c('    if (lo == %d || %s[lo] != %s)', len(numbers), numbers_name, param)
+        _c('        return 0;')
+        _c('    return %s + %s[lo];', blob.name, offsets_name)
+    _c('}')
+
+class _NameBlob(dict):
+    '''
+    Maps names to their offset in one string that holds all names of a
+    module, each terminated by a null character.  Offset 0 is the empty
+    string, which stands for "no name" in the offset tables.
+    '''
+    def __init__(self, name):
+        dict.__init__(self)
+        self.name = name
+        self.names = []
+        self.size = 1
+
+    def add(self, name):
+        if name not in self:
+            self[name] = self.size
+            self.names.append(name)
+            self.size += len(name) + 1
+
+    @property
+    def ctype(self):
+        return 'uint16_t' if self.size <= 0xffff else 'uint32_t'
+
+def _c_name_tables():
+    '''
+    Writes the functions that return the names of the requests, events,
+    errors and enum values of the module.  All names are in one static
+    string and the tables hold offsets into it, so that nothing needs a
+    relocation when the library is loaded.
+    '''
+    tables = [(_n(_ns.prefix + ('RequestName',)), 'uint8_t', 'opcode', 'request with the',
+               _ctx.names['request']),
+              (_n(_ns.prefix + ('EventName',)), 'uint8_t', 'number', 'event with the',
+               _ctx.names['event']),
+              (_n(_ns.prefix + ('ErrorName',)), 'uint8_t', 'number', 'error with the',
+               _ctx.names['error'])]
+    if _ctx.names['ge_event']:
+        tables.append((_n(_ns.prefix + ('GeEventName',)), 'uint16_t', 'event_type',
+                       'generic event with the', _ctx.names['ge_event']))
+    # A table is left out if its function would clash with another name
+    tables = [table for table in tables if not _c_name_taken(table[0])]
+
+    taken = set()
+    for (tname, values) in _ctx.enum_names:
+        function = tname[:-len('_t')] + '_name'
+        if _c_name_taken(function) or function in taken:
+            function = tname[:-len('_t')] + '_value_name'
+            if _c_name_taken(function) or function in taken:
+                continue
+        taken.add(function)
+        names = {}
+        for (value, name) in values:
+            # the first of several items with the same value
+            names.setdefault(value, name)
+        tables.append((function, 'uint32_t', 'value', tname, names))
+
+    blob = _NameBlob(_n(_ns.prefix + ('NameBlob',)))
+    for table in tables:
+        for n in sorted(table[4]):
+            if 0 <= n <= 0xffffffff:
+                blob.add(table[4][n])
+
+    _ctx.cfile.select('name')
+    if _ctx.symbol_report is not None:
+        _ctx.symbol_report.stop()
+    _c('')
+    _c('static const char %s[] =', blob.name)
+    _c('    "\\0"')
+    for name in blob.names:
+        _c('    "%s\\0"', name)
+    _c('    ;')
+
+    for (function, ctype, param, doc, names) in tables:
+        _c_name_table(function, ctype, param, doc, names, blob)
+
+def _write_version_script(name, exports):
+    '''
+    Writes the linker version script name of an extension library.  It
+    exports the symbols in exports and hides everything else, like the
+    <name>_internal definitions.
+    '''
+    lines = ['/* This file generated automatically from %s by c_client.py. */' %
+             os.path.basename(_ns.file),
+             '{',
+             'global:']
+    lines.extend('\t%s;' % name for name in exports)
+    lines.extend(['local:',
+                  '\t*;',
+                  '};',
+                  ''])
+    _write_if_changed(name, '\n'.join(lines))
+
+def _man_write_batch():
+    '''
+    Writes all man pages of the module collected in man-only mode, and
+    the manifest of the alias pages: one line per alias with the name of
+    the alias page and of the page it refers to.
+    '''
+    for (name, data) in _ctx.man_pages:
+        _write_if_changed(name, data)
+    _write_if_changed('man/%s.aliases' % _ns.header,
+                      ''.join('%s %s\n' % alias for alias in _ctx.man_aliases))
 
 def build_collision_table():
-    global namecount
-    namecount = {}
+    namecount = _ctx.namecount
 
-    for v in module.types.values():
+    for v in _ctx.module.types.values():
         name = _t(v[0])
         namecount[name] = (namecount.get(name) or 0) + 1
 
+    for (name, item) in _ctx.module.all:
+        _ctx.element_names.add(_n(name))
+        _ctx.element_names.add(_t(name))
+
+def _c_name_taken(name):
+    '''
+    Returns whether the C name is used already: by a function or variable
+    defined so far, by a type of the module or its imports, or as the
+    function or type name of one of the protocol elements of the module.
+    '''
+    return (name in _ctx.namecount or name in _ctx.element_names or
+            name in _ctx.functions)
+
+def _type_dependencies(item):
+    '''
+    Returns the ids of all types that item refers to, directly or
+    indirectly: field types, list members, switch cases and replies.
+    Also returns the names the fields use for them, which differ for
+    xidtypes and typedefs: these share the type object of the original.
+    '''
+    found = set()
+    names = set()
+    todo = [item]
+    while todo:
+        t = todo.pop()
+        if id(t) in found:
+            continue
+        found.add(id(t))
+        if getattr(t, 'is_list', False):
+            todo.append(t.member)
+        for field in getattr(t, 'fields', ()):
+            todo.append(field.type)
+            names.add(field.field_type)
+        for bitcase in getattr(t, 'bitcases', ()):
+            todo.append(bitcase.type)
+        if getattr(t, 'reply', None) is not None:
+            todo.append(t.reply)
+    return (found, names)
+
+def select_subset(module, only):
+    '''
+    Reduces module.all to the protocol elements named in only, plus all
+    types they depend on.  An entry of only can be the XML name of a
+    request, event, error or type, or any C identifier generated for it
+    (e.g. xcb_foo_reply or xcb_foo_t, as listed by nm); identifiers are
+    matched to the element with the longest C name that is a prefix.
+    Entries that match nothing are ignored, they may belong to another
+    module.  Enums are always kept, they only produce defines.
+    '''
+    # element C names (without _t) and XML names -> indices into module.all
+    by_name = {}
+    for (idx, (name, item)) in enumerate(module.all):
+        for key in (_n(name), name[-1]):
+            by_name.setdefault(key, []).append(idx)
+
+    selected = set()
+    for symbol in only:
+        if symbol in by_name:
+            selected.update(by_name[symbol])
+            continue
+        parts = symbol.lower().split('_')
+        while parts:
+            key = '_'.join(parts)
+            if key in by_name:
+                selected.update(by_name[key])
+                break
+            parts.pop()
+
+    needed = set()
+    needed_names = set()
+    for idx in selected:
+        (found, names) = _type_dependencies(module.all[idx][1])
+        needed.update(found)
+        needed_names.update(names)
+
+    # keep an element if it is selected, if a field refers to it by name,
+    # or if it is the original (not a copy) of a needed type
+    module.all[:] = [(name, item) for (idx, (name, item)) in enumerate(module.all)
+                     if idx in selected or isinstance(item, Enum) or
+                        name in needed_names or
+                        (id(item) in needed and name == item.name)]
+
+def _c_integer(text):
+    '''
+    Returns the value of the integer constant text the way the C compiler
+    reads it.  The enum values of the XML are written to the header as they
+    are, so 0x starts a hexadecimal and a leading 0 an octal number.
+    '''
+    digits = text.strip().rstrip('uUlL')
+    sign = 1
+    if digits.startswith('-'):
+        sign = -1
+        digits = digits[1:].lstrip()
+    if digits.lower().startswith('0x'):
+        return sign * int(digits[2:], 16)
+    if len(digits) > 1 and digits.startswith('0'):
+        return sign * int(digits[1:], 8)
+    return sign * int(digits, 10)
+
+@_header_category('types')
+@_profiled
 def c_enum(self, name):
     '''
     Exported function that handles enum declarations.
     '''
 
-    enums[name] = self
+    _ctx.enums[name] = self
 
     tname = _t(name)
-    if namecount[tname] > 1:
+    if _ctx.namecount[tname] > 1:
         tname = _t(name + ('enum',))
 
     _h_setlevel(0)
@@ -382,14 +1627,33 @@ def c_enum(self, name):
 
     _h('} %s;', tname)
 
+    if _ctx.name_tables:
+        # items without a value count on from the previous one, like in C
+        values = []
+        value = -1
+        for (enam, eval) in self.values:
+            value = value + 1 if eval == '' else _c_integer(eval)
+            values.append((value, enam))
+        _ctx.enum_names.append((tname, values))
+
+@_profiled
 def _c_type_setup(self, name, postfix):
     '''
     Sets up all the C-related state by adding additional data fields to
     all Field and Type objects.  Here is where we figure out most of our
     variable and function names.
 
-    Recurses into child fields and list member types.
+    Recurses into child fields and list member types.  Nothing is done if
+    the type was set up with the same name and postfix the last time, its
+    names are still the right ones then.
     '''
+    if _ctx.finished_type_setup.get(self) == (name, postfix):
+        return
+    _ctx.finished_type_setup[self] = (name, postfix)
+
+    # Any cached analysis was done with other names
+    self.c_analysis = {}
+
     # Do all the various names in advance
     self.c_type = _t(name + postfix)
     self.c_wiretype = 'char' if self.c_type == 'void' else self.c_type
@@ -507,8 +1771,8 @@ def _c_type_setup(self, name, postfix):
     # as switch does never appear at toplevel,
     # continue here with type construction
     if self.is_switch:
-        if self.c_type not in finished_switch:
-            finished_switch.append(self.c_type)
+        if self.c_type not in _ctx.finished_switch:
+            _ctx.finished_switch.add(self.c_type)
             # special: switch C structs get pointer fields for variable-sized members
             _c_complex(self)
             for bitcase in self.bitcases:
@@ -519,8 +1783,8 @@ def _c_type_setup(self, name, postfix):
 
     if not self.is_case_or_bitcase:
         if self.c_need_serialize:
-            if self.c_serialize_name not in finished_serializers:
-                finished_serializers.append(self.c_serialize_name)
+            if self.c_serialize_name not in _ctx.finished_serializers:
+                _ctx.finished_serializers.add(self.c_serialize_name)
                 _c_serialize('serialize', self)
 
                 # _unpack() and _unserialize() are only needed for special cases:
@@ -530,9 +1794,9 @@ def _c_type_setup(self, name, postfix):
                     _c_serialize('unserialize', self)
 
         if self.c_need_sizeof:
-            if self.c_sizeof_name not in finished_sizeof:
-                if not module.namespace.is_ext or self.name[:2] == module.namespace.prefix:
-                    finished_sizeof.append(self.c_sizeof_name)
+            if self.c_sizeof_name not in _ctx.finished_sizeof:
+                if not _ctx.module.namespace.is_ext or self.name[:2] == _ctx.module.namespace.prefix:
+                    _ctx.finished_sizeof.add(self.c_sizeof_name)
                     _c_serialize('sizeof', self)
 
 # Functions for querying field properties
@@ -649,10 +1913,30 @@ def _c_helper_resolve_field_names (prefix):
 
     return all_fields
 
+def _cached_analysis(obj, key, func, *args):
+    '''
+    Returns func(*args), computed only once per key and type obj.
+    The results are lists or tuples of lists, callers get copies of them.
+    '''
+    try:
+        cache = obj.c_analysis
+    except AttributeError:
+        cache = obj.c_analysis = {}
+    try:
+        result = cache[key]
+    except KeyError:
+        result = cache[key] = func(*args)
+    if isinstance(result, tuple):
+        return tuple(list(r) for r in result)
+    return list(result)
+
 def get_expr_fields(self):
     """
     get the Fields referenced by switch or list expression
     """
+    return _cached_analysis(self, 'expr_fields', _get_expr_fields, self)
+
+def _get_expr_fields(self):
     def get_expr_field_names(expr):
         if expr.op is None or expr.op == 'calculate_len':
             if expr.lenfield_name is not None:
@@ -704,6 +1988,10 @@ def resolve_expr_fields(complex_obj):
     find expr fields appearing in complex_obj and descendents that cannot be resolved within complex_obj
     these are normally fields that need to be given as function parameters
     """
+    return _cached_analysis(complex_obj, 'resolve_expr_fields',
+                            _resolve_expr_fields, complex_obj)
+
+def _resolve_expr_fields(complex_obj):
     all_fields = []
     expr_fields = []
     unresolved = []
@@ -728,6 +2016,10 @@ def resolve_expr_fields_list(self, parents):
     These are normally fields that need to be given as function parameters
     for length and iterator functions.
     """
+    return _cached_analysis(self, ('resolve_expr_fields_list',) + tuple(id(p) for p in parents),
+                            _resolve_expr_fields_list, self, parents)
+
+def _resolve_expr_fields_list(self, parents):
     all_fields = []
     expr_fields = get_expr_fields(self)
     unresolved = []
@@ -755,6 +2047,10 @@ def get_serialize_params(context, self, buffer_var='_buffer', aux_var='_aux'):
     expression. This function tries to resolve all fields within a structure, and returns the
     unresolved fields as the list of external parameters.
     """
+    return _cached_analysis(self, ('serialize_params', context, buffer_var, aux_var),
+                            _get_serialize_params, context, self, buffer_var, aux_var)
+
+def _get_serialize_params(context, self, buffer_var, aux_var):
     def add_param(params, param):
         if param not in params:
             params.append(param)
@@ -1167,7 +2463,7 @@ def _c_serialize_helper_fields(context, self,
     need_padding = False
     prev_field_was_variable = False
 
-    _c_pre.push_indent(space + '    ')
+    _ctx.c_pre.push_indent(space + '    ')
 
     for field in self.fields:
         if not field.wire:
@@ -1261,7 +2557,7 @@ def _c_serialize_helper_fields(context, self,
         if self.c_var_followed_by_fixed_fields:
             need_padding = False
 
-    _c_pre.pop_indent()
+    _ctx.c_pre.pop_indent()
 
     return count
 
@@ -1304,6 +2600,7 @@ def _c_serialize_helper(context, complex_type,
 
     return count
 
+@_profiled
 def _c_serialize(context, self):
     """
     depending on the context variable, generate _serialize(), _unserialize(), _unpack(), or _sizeof()
@@ -1312,10 +2609,6 @@ def _c_serialize(context, self):
     _h_setlevel(1)
     _c_setlevel(1)
 
-    _hc('')
-    # _serialize() returns the buffer size
-    _hc('int')
-
     if self.is_switch and 'unserialize' == context:
         context = 'unpack'
 
@@ -1325,6 +2618,11 @@ def _c_serialize(context, self):
               'sizeof'      : self.c_sizeof_name }
     func_name = cases[context]
 
+    _c_function(func_name, context)
+    _h('')
+    # _serialize() returns the buffer size
+    _hc('int')
+
     param_fields, wire_fields, params = get_serialize_params(context, self)
     variable_size_fields = 0
     # maximum space required for type definition of function arguments
@@ -1358,7 +2656,7 @@ def _c_serialize(context, self):
     temp_vars = []
     prefix = []
 
-    _c_pre.redirect_start(code_lines, temp_vars)
+    _ctx.c_pre.redirect_start(code_lines, temp_vars)
 
     if 'serialize' == context:
         if not self.is_switch and not self.c_var_followed_by_fixed_fields:
@@ -1407,13 +2705,13 @@ def _c_serialize(context, self):
             _c('    %s _aux;', self.c_type)
             _c('    return %s(%s, &_aux);', self.c_unpack_name, ", ".join(param_names))
             _c('}')
-            _c_pre.redirect_end()
+            _ctx.c_pre.redirect_end()
             return
         elif self.c_var_followed_by_fixed_fields:
             # special case: call _unserialize()
             _c('    return %s(%s, NULL);', self.c_unserialize_name, ", ".join(param_names))
             _c('}')
-            _c_pre.redirect_end()
+            _ctx.c_pre.redirect_end()
             return
         else:
             _c('    char *xcb_tmp = (char *)_buffer;')
@@ -1449,7 +2747,7 @@ def _c_serialize(context, self):
             _c('    unsigned int xcb_pad = 0;')
             _c('    unsigned int xcb_align_to = 0;')
 
-    _c_pre.redirect_end()
+    _ctx.c_pre.redirect_end()
 
     _c('')
     for t in temp_vars:
@@ -1502,8 +2800,7 @@ def _c_serialize(context, self):
         # unserialize: assign variable size fields individually
         if 'unserialize' == context:
             _c('    xcb_tmp = ((char *)*_aux)+xcb_buffer_len;')
-            param_fields.reverse()
-            for field in param_fields:
+            for field in reversed(param_fields):
                 if not field.type.fixed_size():
                     _c('    xcb_tmp -= %s_len;', field.c_field_name)
                     _c('    memmove(xcb_tmp, %s, %s_len);', field.c_field_name, field.c_field_name)
@@ -1529,6 +2826,8 @@ def _c_iterator_get_end(field, accum):
         else:
             return field.type.member.c_end_name + '(' + field.c_iterator_name + '(' + accum + '))'
 
+@_header_category('accessors')
+@_profiled
 def _c_iterator(self, name):
     '''
     Declares the iterator structure and next/end functions for a given type.
@@ -1563,7 +2862,7 @@ def _c_iterator(self, name):
     _h(' * decreased by one. The member data points to the next')
     _h(' * element. The member index is increased by sizeof(%s)', self.c_type)
     _h(' */')
-    _c('')
+    _c_function(self.c_next_name, 'iterator')
     _hc('void')
     _h('%s (%s *i);', self.c_next_name, self.c_iterator_type)
     _c('%s (%s *i)', self.c_next_name, self.c_iterator_type)
@@ -1593,12 +2892,17 @@ def _c_iterator(self, name):
             _c('    i->data = (%s *) child.data;', self.c_type)
 
     else:
-        _c('    --i->rem;')
-        _c('    ++i->data;')
-        _c('    i->index += sizeof(%s);', self.c_type)
+        next_body = ['    --i->rem;',
+                     '    ++i->data;',
+                     '    i->index += sizeof(%s);' % self.c_type]
+        for line in next_body:
+            _c('%s', line)
 
     _c('}')
 
+    if self.fixed_size():
+        _h_inline('void', self.c_next_name, '%s *i' % self.c_iterator_type, ['i'], next_body)
+
     _h('')
     _h('/**')
     _h(' * Return the iterator pointing to the last element')
@@ -1609,7 +2913,7 @@ def _c_iterator(self, name):
     _h(' * The member rem is set to 0. The member data points to the')
     _h(' * last element.')
     _h(' */')
-    _c('')
+    _c_function(self.c_end_name, 'iterator')
     _hc('xcb_generic_iterator_t')
     _h('%s (%s i);', self.c_end_name, self.c_iterator_type)
     _c('%s (%s i)', self.c_end_name, self.c_iterator_type)
@@ -1617,9 +2921,13 @@ def _c_iterator(self, name):
     _c('    xcb_generic_iterator_t ret;')
 
     if self.fixed_size():
-        _c('    ret.data = i.data + i.rem;')
-        _c('    ret.index = i.index + ((char *) ret.data - (char *) i.data);')
-        _c('    ret.rem = 0;')
+        end_body = ['    xcb_generic_iterator_t ret;',
+                    '    ret.data = i.data + i.rem;',
+                    '    ret.index = i.index + ((char *) ret.data - (char *) i.data);',
+                    '    ret.rem = 0;',
+                    '    return ret;']
+        for line in end_body[1:-1]:
+            _c('%s', line)
     else:
         _c('    while(i.rem > 0)')
         _c('        %s(&i);', self.c_next_name)
@@ -1630,6 +2938,147 @@ def _c_iterator(self, name):
     _c('    return ret;')
     _c('}')
 
+    if self.fixed_size():
+        _h_inline('xcb_generic_iterator_t', self.c_end_name, '%s i' % self.c_iterator_type, ['i'], end_body)
+    elif _ctx.list_index and not self.is_union:
+        _c_index(self, name)
+
+def _c_index(self, name):
+    '''
+    Declares the index of a list of variable-size elements: the offsets of
+    all elements, found in one pass with the iterator, so that element i
+    can be read in constant time and sorted lists can be searched.
+
+    Nothing is declared if one of the names is taken, e.g. by a type
+    FooIndex of the protocol.
+    '''
+    index_type = _t(name + ('index',))
+    build_name = _n(name + ('index', 'build'))
+    free_name = _n(name + ('index', 'free'))
+    at_name = _n(name + ('at',))
+    bsearch_name = _n(name + ('bsearch',))
+    for c_name in (index_type, build_name, free_name, at_name, bsearch_name):
+        if _c_name_taken(c_name):
+            return
+    _ctx.element_names.add(index_type)
+
+    _h('')
+    _h('/**')
+    _h(' * @brief %s', index_type)
+    _h(' **/')
+    _h('typedef struct %s {', index_type)
+    _h('    %s *data;', self.c_type)
+    _h('    int%s length;', ' ' * (len(self.c_type) - 2))
+    _h('    uint32_t%s *offsets;', ' ' * (len(self.c_type) - 8))
+    _h('    int%s allocated;', ' ' * (len(self.c_type) - 2))
+    _h('} %s;', index_type)
+
+    _h('')
+    _h('/**')
+    _h(' * Build the index of the elements of an iterator')
+    _h(' * @param i       The iterator, pointing to the first element')
+    _h(' * @param offsets Room for i.rem offsets, or NULL to allocate them')
+    _h(' * @param index   The index to fill in')
+    _h(' * @return        0 on success, -1 if the offsets could not be allocated')
+    _h(' *')
+    _h(' * Walks the list once.  Allocated offsets are freed by %s().', free_name)
+    _h(' */')
+    _c_function(build_name, 'iterator')
+    _hc('int')
+    _h('%s (%s  i,', build_name, self.c_iterator_type)
+    _c('%s (%s  i,', build_name, self.c_iterator_type)
+    spacing = ' ' * (len(build_name) + 2)
+    _hc('%s%s *offsets,', spacing, 'uint32_t' + ' ' * (len(self.c_iterator_type) - len('uint32_t')))
+    _h('%s%s *index);', spacing, index_type + ' ' * (len(self.c_iterator_type) - len(index_type)))
+    _c('%s%s *index)', spacing, index_type + ' ' * (len(self.c_iterator_type) - len(index_type)))
+    _c('{')
+    _c('    int n;')
+    _c('    index->data = i.data;')
+    _c('    index->length = i.rem;')
+    _c('    index->allocated = 0;')
+    _c('    if (offsets == NULL && i.rem > 0) {')
+    _c('        offsets = malloc(i.rem * sizeof(uint32_t));')
+    _c('        if (offsets == NULL) {')
+    _c('            index->offsets = NULL;')
+    _c('            return -1;')
+    _c('        }')
+    _c('        index->allocated = 1;')
+    _c('    }')
+    _c('    index->offsets = offsets;')
+    _c('    for (n = 0; n < index->length; n++) {')
+    _c('        offsets[n] = (char *) i.data - (char *) index->data;')
+    _c('        %s(&i);', self.c_next_name)
+    _c('    }')
+    _c('    return 0;')
+    _c('}')
+
+    _h('')
+    _h('/**')
+    _h(' * Free the offsets of an index, if %s() allocated them', build_name)
+    _h(' * @param index The index')
+    _h(' */')
+    _c_function(free_name, 'iterator')
+    _hc('void')
+    _h('%s (%s *index);', free_name, index_type)
+    _c('%s (%s *index)', free_name, index_type)
+    _c('{')
+    _c('    if (index->allocated)')
+    _c('        free(index->offsets);')
+    _c('    index->offsets = NULL;')
+    _c('    index->allocated = 0;')
+    _c('}')
+
+    _h('')
+    _h('/**')
+    _h(' * Return element i of an index')
+    _h(' * @param index The index')
+    _h(' * @param i     The number of the element, less than index->length')
+    _h(' * @return      Pointer to the element')
+    _h(' */')
+    at_body = ['    return (%s *) ((char *) index->data + index->offsets[i]);' % self.c_type]
+    _c_function(at_name, 'iterator')
+    _hc('%s *', self.c_type)
+    _h('%s (const %s *index, int i);', at_name, index_type)
+    _c('%s (const %s *index, int i)', at_name, index_type)
+    _c('{')
+    for line in at_body:
+        _c('%s', line)
+    _c('}')
+    _h_inline('%s *' % self.c_type, at_name, 'const %s *index, int i' % index_type, ['index', 'i'], at_body)
+
+    _h('')
+    _h('/**')
+    _h(' * Find an element of a sorted list')
+    _h(' * @param index   The index of the list, sorted as compar sorts')
+    _h(' * @param key     The key to look for')
+    _h(' * @param compar  Compares key to an element, returns less than, equal to or')
+    _h(' *                greater than 0 like the compar function of bsearch()')
+    _h(' * @return        The element that matches key, or NULL if there is none')
+    _h(' */')
+    _c_function(bsearch_name, 'iterator')
+    _hc('%s *', self.c_type)
+    spacing = ' ' * (len(bsearch_name) + 2)
+    _hc('%s (const %s *index,', bsearch_name, index_type)
+    _hc('%sconst void *key,', spacing)
+    _h('%sint (*compar)(const void *key, const %s *element));', spacing, self.c_type)
+    _c('%sint (*compar)(const void *key, const %s *element))', spacing, self.c_type)
+    _c('{')
+    _c('    int lo = 0;')
+    _c('    int hi = index->length;')
+    _c('    while (lo < hi) {')
+    _c('        int mid = lo + (hi - lo) / 2;')
+    _c('        %s *element = (%s *) ((char *) index->data + index->offsets[mid]);', self.c_type, self.c_type)
+    _c('        int c = compar(key, element);')
+    _c('        if (c == 0)')
+    _c('            return element;')
+    _c('        if (c < 0)')
+    _c('            hi = mid;')
+    _c('        else')
+    _c('            lo = mid + 1;')
+    _c('    }')
+    _c('    return NULL;')
+    _c('}')
+
 def _c_accessor_get_length(expr, field_mapping=None):
     '''
     Figures out what C code is needed to get a length field.
@@ -1675,32 +3124,32 @@ def _c_accessor_get_expr(expr, field_mapping):
         c_length_func = _c_accessor_get_expr(field.type.expr, field_mapping)
         # create explicit code for computing the sum.
         # This works for all C-types which can be added to int64_t with +=
-        _c_pre.start()
-        lengthvar = _c_pre.get_tempvarname()
-        loopvar = _c_pre.get_tempvarname()
-        sumvar = _c_pre.get_tempvarname()
-        listvar = _c_pre.get_tempvarname()
-        _c_pre.tempvar("int %s; /* sumof length */", lengthvar)
-        _c_pre.tempvar("int %s; /* sumof loop counter */", loopvar)
-        _c_pre.tempvar("int64_t %s; /* sumof sum */", sumvar)
-        _c_pre.tempvar("const %s* %s; /* sumof list ptr */", field.c_field_type, listvar)
-        _c_pre.code("/* sumof start */")
-        _c_pre.code("%s = %s;", lengthvar, c_length_func)
-        _c_pre.code("%s = 0;", sumvar)
-        _c_pre.code("%s = %s;", listvar, list_name)
-        _c_pre.code("for (%s = 0; %s < %s; %s++) {", loopvar, loopvar, lengthvar, loopvar)
-        _c_pre.indent()
+        _ctx.c_pre.start()
+        lengthvar = _ctx.c_pre.get_tempvarname()
+        loopvar = _ctx.c_pre.get_tempvarname()
+        sumvar = _ctx.c_pre.get_tempvarname()
+        listvar = _ctx.c_pre.get_tempvarname()
+        _ctx.c_pre.tempvar("int %s; /* sumof length */", lengthvar)
+        _ctx.c_pre.tempvar("int %s; /* sumof loop counter */", loopvar)
+        _ctx.c_pre.tempvar("int64_t %s; /* sumof sum */", sumvar)
+        _ctx.c_pre.tempvar("const %s* %s; /* sumof list ptr */", field.c_field_type, listvar)
+        _ctx.c_pre.code("/* sumof start */")
+        _ctx.c_pre.code("%s = %s;", lengthvar, c_length_func)
+        _ctx.c_pre.code("%s = 0;", sumvar)
+        _ctx.c_pre.code("%s = %s;", listvar, list_name)
+        _ctx.c_pre.code("for (%s = 0; %s < %s; %s++) {", loopvar, loopvar, lengthvar, loopvar)
+        _ctx.c_pre.indent()
 
         # define and set xcb_listelement, so that it can be used by
         # listelement-ref expressions.
         if expr.contains_listelement_ref:
-            _c_pre.code(
+            _ctx.c_pre.code(
                 "const %s *xcb_listelement = %s;",
                 field.c_field_type, listvar)
 
         # summation
         if expr.rhs is None:
-            _c_pre.code("%s += *%s;", sumvar, listvar)
+            _ctx.c_pre.code("%s += *%s;", sumvar, listvar)
         else:
             # sumof has a nested expression which has to be evaluated in
             # the context of this list element
@@ -1715,19 +3164,19 @@ def _c_accessor_get_expr(expr, field_mapping):
                         [(listvar, '->', field.type.member)]))
 
             # cause pre-code of the subexpression be added right here
-            _c_pre.end()
+            _ctx.c_pre.end()
             # compute the subexpression
             rhs_expr_str = _c_accessor_get_expr(expr.rhs, scoped_field_mapping)
             # resume with our code
-            _c_pre.start()
+            _ctx.c_pre.start()
             # output the summation expression
-            _c_pre.code("%s += %s;", sumvar, rhs_expr_str)
+            _ctx.c_pre.code("%s += %s;", sumvar, rhs_expr_str)
 
-        _c_pre.code("%s++;", listvar)
-        _c_pre.pop_indent()
-        _c_pre.code("}")
-        _c_pre.code("/* sumof end. Result is in %s */", sumvar)
-        _c_pre.end()
+        _ctx.c_pre.code("%s++;", listvar)
+        _ctx.c_pre.pop_indent()
+        _ctx.c_pre.code("}")
+        _ctx.c_pre.code("/* sumof end. Result is in %s */", sumvar)
+        _ctx.c_pre.end()
         return sumvar
     elif expr.op == 'listelement-ref':
         return '(*xcb_listelement)'
@@ -1745,6 +3194,8 @@ def type_pad_type(type):
         return 'char'
     return type
 
+@_header_category('accessors')
+@_profiled
 def _c_accessors_field(self, field):
     '''
     Declares the accessor functions for a non-list field that follows a variable-length field.
@@ -1758,8 +3209,9 @@ def _c_accessors_field(self, field):
     if switch_obj is not None:
         c_type = switch_obj.c_type
 
+    _c_function(field.c_accessor_name, 'accessor')
     if field.type.is_simple:
-        _hc('')
+        _h('')
         _hc('%s', field.c_field_type)
         _h('%s (const %s *R);', field.c_accessor_name, c_type)
         _c('%s (const %s *R)', field.c_accessor_name, c_type)
@@ -1772,7 +3224,7 @@ def _c_accessors_field(self, field):
                field.c_field_type, type_pad_type(field.first_field_after_varsized.type.c_type), field.prev_varsized_offset)
         _c('}')
     else:
-        _hc('')
+        _h('')
         if field.type.is_switch and switch_obj is None:
             return_type = 'void *'
         else:
@@ -1794,6 +3246,25 @@ def _c_accessors_field(self, field):
         _c('}')
 
 
+def _c_list_align_pad(field, prev='prev'):
+    '''
+    Returns the variable-size field whose end the list field starts after,
+    and the C expression for the padding in between if it comes from an
+    align pad, None otherwise.  prev is the end iterator of that field.
+    '''
+    prev_field = field.prev_varsized_field
+    prev_prev = field.prev_varsized_field.prev_varsized_field
+
+    if prev_field.type.is_pad and prev_field.type.align > 0 and prev_prev is not None:
+        return (prev_prev, '((-%s.index) & (%d - 1))' % (prev, prev_field.type.align))
+    else:
+        return (prev_field, None)
+
+# length expressions that are just a field of the fixed part or a number
+_c_inline_length_re = re.compile(r'^(R->\w+|\d+)$')
+
+@_header_category('accessors')
+@_profiled
 def _c_accessors_list(self, field):
     '''
     Declares the accessor functions for a list field.
@@ -1801,15 +3272,6 @@ def _c_accessors_list(self, field):
     Declares length and get-iterator functions always.
     '''
 
-    def get_align_pad(field):
-        prev = field.prev_varsized_field
-        prev_prev = field.prev_varsized_field.prev_varsized_field
-
-        if prev.type.is_pad and prev.type.align > 0 and prev_prev is not None:
-            return (prev_prev, '((-prev.index) & (%d - 1))' % prev.type.align)
-        else:
-            return (prev, None)
-
     list = field.type
     c_type = self.c_type
 
@@ -1885,7 +3347,8 @@ def _c_accessors_list(self, field):
     _c_setlevel(1)
     if list.member.fixed_size():
         idx = 1 if switch_obj is not None else 0
-        _hc('')
+        _c_function(field.c_accessor_name, 'accessor')
+        _h('')
         _hc('%s *', field.c_field_type)
 
         _h('%s (%s);', field.c_accessor_name, params[idx][0])
@@ -1897,7 +3360,7 @@ def _c_accessors_list(self, field):
         elif field.prev_varsized_field is None:
             _c('    return (%s *) (R + 1);', field.c_field_type)
         else:
-            (prev_varsized_field, align_pad) = get_align_pad(field)
+            (prev_varsized_field, align_pad) = _c_list_align_pad(field)
 
             if align_pad is None:
                 align_pad = ('XCB_TYPE_PAD(%s, prev.index)' %
@@ -1909,7 +3372,12 @@ def _c_accessors_list(self, field):
                field.c_field_type, align_pad, field.prev_varsized_offset)
         _c('}')
 
-    _hc('')
+        if switch_obj is None and field.prev_varsized_field is None:
+            _h_inline('%s *' % field.c_field_type, field.c_accessor_name, params[idx][0], ['R'],
+                      ['    return (%s *) (R + 1);' % field.c_field_type])
+
+    _c_function(field.c_length_name, 'accessor')
+    _h('')
     _hc('int')
     spacing = ' '*(len(field.c_length_name)+2)
     add_param_str = additional_params_to_str(spacing)
@@ -1948,11 +3416,24 @@ def _c_accessors_list(self, field):
         else:
             return _c_accessor_get_expr(field.type.expr, fields)
 
-    _c('    return %s;', get_length())
+    length = get_length()
+    _c('    return %s;', length)
     _c('}')
 
+    # A list right after the fixed part starts at R + 1, and its length is
+    # a field of the fixed part or follows from the request length: these
+    # accessors get static inline copies in the header
+    inline_length = None
+    if switch_obj is None and field.prev_varsized_field is None and not additional_params:
+        if field.type.expr.op == 'calculate_len' or _c_inline_length_re.match(length):
+            inline_length = length
+    if inline_length is not None:
+        _h_inline('int', field.c_length_name, 'const %s *R' % c_type, ['R'],
+                  ['    return %s;' % inline_length])
+
     if field.type.member.is_simple:
-        _hc('')
+        _c_function(field.c_end_name, 'accessor')
+        _h('')
         _hc('xcb_generic_iterator_t')
         spacing = ' '*(len(field.c_end_name)+2)
         add_param_str = additional_params_to_str(spacing)
@@ -1974,7 +3455,7 @@ def _c_accessors_list(self, field):
             _c('    i.data = ((%s *) (R + 1)) + (%s);', field.type.c_wiretype,
                get_length())
         else:
-            (prev_varsized_field, align_pad) = get_align_pad(field)
+            (prev_varsized_field, align_pad) = _c_list_align_pad(field)
 
             if align_pad is None:
                 align_pad = ('XCB_TYPE_PAD(%s, prev.index)' %
@@ -1991,8 +3472,17 @@ def _c_accessors_list(self, field):
         _c('    return i;')
         _c('}')
 
+        if inline_length is not None:
+            _h_inline('xcb_generic_iterator_t', field.c_end_name, 'const %s *R' % c_type, ['R'],
+                      ['    xcb_generic_iterator_t i;',
+                       '    i.data = ((%s *) (R + 1)) + (%s);' % (field.type.c_wiretype, inline_length),
+                       '    i.rem = 0;',
+                       '    i.index = (char *) i.data - (char *) R;',
+                       '    return i;'])
+
     else:
-        _hc('')
+        _c_function(field.c_iterator_name, 'accessor')
+        _h('')
         _hc('%s', field.c_iterator_type)
         spacing = ' '*(len(field.c_iterator_name)+2)
         if switch_obj is not None:
@@ -2005,18 +3495,18 @@ def _c_accessors_list(self, field):
         _c('{')
         _c('    %s i;', field.c_iterator_type)
 
-        _c_pre.start()
+        _ctx.c_pre.start()
         length_expr_str = get_length()
 
         if switch_obj is not None:
-            _c_pre.end()
+            _ctx.c_pre.end()
             _c('    i.data = %s;', fields[field.c_field_name][0])
             _c('    i.rem = %s;', length_expr_str)
         elif field.prev_varsized_field == None:
-            _c_pre.end()
+            _ctx.c_pre.end()
             _c('    i.data = (%s *) (R + 1);', field.c_field_type)
         else:
-            (prev_varsized_field, align_pad) = get_align_pad(field)
+            (prev_varsized_field, align_pad) = _c_list_align_pad(field)
 
             if align_pad is None:
                 align_pad = ('XCB_TYPE_PAD(%s, prev.index)' %
@@ -2024,7 +3514,7 @@ def _c_accessors_list(self, field):
 
             _c('    xcb_generic_iterator_t prev = %s;',
                 _c_iterator_get_end(prev_varsized_field, 'R'))
-            _c_pre.end()
+            _ctx.c_pre.end()
             _c('    i.data = (%s *) ((char *) prev.data + %s);',
                 field.c_field_type, align_pad)
 
@@ -2041,6 +3531,16 @@ def _c_accessors_list(self, field):
         _c('    return i;')
         _c('}')
 
+        if inline_length is not None and not additional_iter_fields:
+            _h_inline(field.c_iterator_type, field.c_iterator_name, 'const %s *R' % c_type, ['R'],
+                      ['    %s i;' % field.c_iterator_type,
+                       '    i.data = (%s *) (R + 1);' % field.c_field_type,
+                       '    i.rem = %s;' % inline_length,
+                       '    i.index = (char *) i.data - (char *) R;',
+                       '    return i;'])
+
+@_header_category('accessors')
+@_profiled
 def _c_accessors(self, name, base):
     '''
     Declares the accessor functions for the fields of a structure.
@@ -2057,7 +3557,200 @@ def _c_accessors(self, name, base):
                     _c_accessors_list(self, field)
                 elif _c_field_needs_field_accessor(field):
                     _c_accessors_field(self, field)
+        _c_layout(self, name)
+
+def _c_layout_code(self, fields):
+    '''
+    Returns (members, declarations, code) of the layout function of self
+    for the fields with accessors, or None if it cannot be generated.
+
+    Every field starts where its accessor says, but the end of the
+    variable-size field before it is taken from a local variable instead
+    of being found again from the start of the structure.
+    '''
+    parents = [self]
+    # fields whose end the start of a later field depends on
+    needed = set()
+    for field in fields:
+        if field.prev_varsized_field is None:
+            continue
+        if field.type.is_list:
+            needed.add(id(_c_list_align_pad(field)[0]))
+        else:
+            needed.add(id(field.prev_varsized_field))
+
+    members = []
+    declarations = []
+    code = []
+    # fields whose end is known as <name>_end
+    ends = set()
+    for field in fields:
+        name = field.c_field_name
+        if field.type.is_list:
+            member_type = '%s *' % field.c_field_type
+            if field.prev_varsized_field is None:
+                start = '(%s *) (R + 1)' % field.c_field_type
+            else:
+                prev_field = _c_list_align_pad(field)[0]
+                if id(prev_field) not in ends:
+                    return None
+                prev = '%s_end' % prev_field.c_field_name
+                align_pad = _c_list_align_pad(field, prev)[1]
+                if field.type.member.fixed_size():
+                    # as in the direct accessor
+                    if align_pad is None:
+                        align_pad = ('XCB_TYPE_PAD(%s, %s.index)' %
+                            (type_pad_type(field.first_field_after_varsized.type.c_type), prev))
+                    start = ('(%s *) ((char *) %s.data + %s + %d)' %
+                             (field.c_field_type, prev, align_pad, field.prev_varsized_offset))
+                else:
+                    # as in the iterator
+                    if align_pad is None:
+                        align_pad = ('XCB_TYPE_PAD(%s, %s.index)' %
+                            (type_pad_type(field.c_field_type), prev))
+                    start = '(%s *) ((char *) %s.data + %s)' % (field.c_field_type, prev, align_pad)
+
+            if resolve_expr_fields_list(field.type, parents):
+                # the length needs additional parameters
+                return None
+            if field.type.expr.op == 'calculate_len' and field.prev_varsized_field is not None:
+                length = ('((((char *) R) + R->length * 4) - (char *) layout->%s) / sizeof(%s)' %
+                          (name, field.type.member.c_wiretype))
+            else:
+                length = '%s(R)' % field.c_length_name
+
+            members.append('    %s%s;' % (member_type, name))
+            members.append('    int %s_length;' % name)
+            code.append('    layout->%s = %s;' % (name, start))
+            code.append('    layout->%s_length = %s;' % (name, length))
+
+            if id(field) in needed:
+                end = '%s_end' % name
+                declarations.append('    xcb_generic_iterator_t %s;' % end)
+                if field.type.member.is_simple:
+                    code.append('    %s.data = ((%s *) layout->%s) + layout->%s_length;' %
+                                (end, field.type.c_wiretype, name, name))
+                    code.append('    %s.rem = 0;' % end)
+                    code.append('    %s.index = (char *) %s.data - (char *) R;' % (end, end))
+                else:
+                    if _c_get_additional_type_params(field.type.member):
+                        return None
+                    iterator = '%s_iterator' % name
+                    declarations.append('    %s %s;' % (field.c_iterator_type, iterator))
+                    code.append('    %s.data = layout->%s;' % (iterator, name))
+                    code.append('    %s.rem = layout->%s_length;' % (iterator, name))
+                    code.append('    %s.index = (char *) %s.data - (char *) R;' % (iterator, iterator))
+                    code.append('    %s = %s(%s);' % (end, field.type.member.c_end_name, iterator))
+                ends.add(id(field))
+        else:
+            # as in the accessor, a switch is only pointed to, it has to
+            # be unpacked by the caller
+            if field.type.is_switch:
+                member_type = 'void *'
+            else:
+                member_type = '%s *' % field.c_field_type
+            if field.prev_varsized_field is None:
+                start = '(%s) (R + 1)' % member_type
+            else:
+                if id(field.prev_varsized_field) not in ends:
+                    return None
+                prev = '%s_end' % field.prev_varsized_field.c_field_name
+                start = ('(%s) ((char *) %s.data + XCB_TYPE_PAD(%s, %s.index) + %d)' %
+                         (member_type, prev,
+                          type_pad_type(field.first_field_after_varsized.type.c_type), prev,
+                          field.prev_varsized_offset))
+
+            members.append('    %s%s;' % (member_type, name))
+            code.append('    layout->%s = %s;' % (name, start))
+
+            if id(field) in needed:
+                if (field.type.is_switch or not field.type.is_container or
+                    field.type.last_varsized_field is None):
+                    return None
+                end_expr = _c_iterator_get_end(field.type.last_varsized_field, 'layout->%s' % name)
+                if end_expr is None:
+                    return None
+                declarations.append('    xcb_generic_iterator_t %s_end;' % name)
+                code.append('    %s_end = %s;' % (name, end_expr))
+                ends.add(id(field))
+
+    return (members, declarations, code)
+
+@_header_category('accessors')
+@_profiled
+def _c_layout(self, name):
+    '''
+    Declares the layout structure and function of a structure with fields
+    after variable-size fields.  The accessor of such a field finds the
+    end of all variable-size fields before it, so reading every field
+    takes quadratic time.  The layout function walks the structure once
+    and stores where each field with an accessor starts, and the lengths
+    of the lists.
+
+    The names are derived from the C type, e.g. xcb_foo_event_layout_t
+    and xcb_foo_event_layout() for the event Foo.  Nothing is declared
+    if one of them is taken.
+    '''
+    if self.is_switch or self.is_case_or_bitcase or self.is_union or not self.is_container:
+        return
+    if hasattr(self, 'parents') and self.parents[0] is not self:
+        return
+
+    fields = [field for field in self.fields
+              if not field.type.is_pad and _c_field_needs_accessor(field)]
+    if not any(field.prev_varsized_field is not None for field in fields):
+        return
+
+    # xcb_foo_t -> xcb_foo_layout_t
+    layout_name = '%s_layout' % self.c_type[:-2]
+    layout_type = '%s_t' % layout_name
+    if (_c_name_taken(layout_name) or _c_name_taken(layout_type) or
+        any(getattr(field, 'c_accessor_name', None) == layout_name for field in self.fields)):
+        return
+    _ctx.element_names.add(layout_type)
+
+    result = _c_layout_code(self, fields)
+    if result is None:
+        return
+    (members, declarations, code) = result
+
+    _h_setlevel(1)
+    _c_setlevel(1)
+    _h('')
+    _h('/**')
+    _h(' * @brief %s', layout_type)
+    _h(' **/')
+    _h('typedef struct %s {', layout_type)
+    for line in members:
+        _h('%s', line)
+    _h('} %s;', layout_type)
+
+    _h('')
+    _h('/**')
+    _h(' * Find all fields of a %s in one pass', self.c_type)
+    _h(' * @param R      The structure')
+    _h(' * @param layout Filled with the start of every field that has an accessor,')
+    _h(' *               and the lengths of the lists')
+    _h(' *')
+    _h(' * Reading the fields through the layout takes constant time each,')
+    _h(' * the accessors of fields after variable-size fields do not.')
+    _h(' */')
+    _c_function(layout_name, 'accessor')
+    _hc('void')
+    _h('%s (const %s *R, %s *layout);', layout_name, self.c_type, layout_type)
+    _c('%s (const %s *R, %s *layout)', layout_name, self.c_type, layout_type)
+    _c('{')
+    for line in declarations:
+        _c('%s', line)
+    if declarations:
+        _c('')
+    for line in code:
+        _c('%s', line)
+    _c('}')
 
+@_header_category('types')
+@_function_group
+@_profiled
 def c_simple(self, name):
     '''
     Exported function that handles cardinal type declarations.
@@ -2075,6 +3768,7 @@ def c_simple(self, name):
         # Iterator
         _c_iterator(self, name)
 
+@_profiled
 def _c_complex(self, force_packed = False):
     '''
     Helper function for handling all structure types.
@@ -2129,6 +3823,9 @@ def _c_complex(self, force_packed = False):
 
     _h('} %s%s;', 'XCB_PACKED ' if force_packed else '', self.c_type)
 
+@_header_category('types')
+@_function_group
+@_profiled
 def c_struct(self, name):
     '''
     Exported function that handles structure declarations.
@@ -2138,6 +3835,9 @@ def c_struct(self, name):
     _c_accessors(self, name, name)
     _c_iterator(self, name)
 
+@_header_category('types')
+@_function_group
+@_profiled
 def c_union(self, name):
     '''
     Exported function that handles union declarations.
@@ -2146,6 +3846,7 @@ def c_union(self, name):
     _c_complex(self)
     _c_iterator(self, name)
 
+@_profiled
 def _c_request_helper(self, name, void, regular, aux=False, reply_fds=False):
     '''
     Declares a request function.
@@ -2245,7 +3946,7 @@ def _c_request_helper(self, name, void, regular, aux=False, reply_fds=False):
                 key = ('xcb', field.enum)
 
                 tname = _t(key)
-                if namecount[tname] > 1:
+                if _ctx.namecount[tname] > 1:
                     tname = _t(key + ('enum',))
                 _h(' * @param %s A bitmask of #%s values.' % (field.c_field_name, tname))
 
@@ -2283,7 +3984,7 @@ def _c_request_helper(self, name, void, regular, aux=False, reply_fds=False):
         _h(' * a reply to be generated. Any returned error will be')
         _h(' * placed in the event queue.')
     _h(' */')
-    _c('')
+    _c_function(func_name, 'request')
     _hc('%s', func_cookie)
 
     spacing = ' ' * (maxtypelen - len('xcb_connection_t'))
@@ -2488,6 +4189,7 @@ def _c_request_helper(self, name, void, regular, aux=False, reply_fds=False):
     _c('    return xcb_ret;')
     _c('}')
 
+@_profiled
 def _c_reply(self, name):
     '''
     Declares the function that returns the reply structure.
@@ -2533,7 +4235,7 @@ def _c_reply(self, name):
     _h(' *')
     _h(' * The returned value must be freed by the caller using free().')
     _h(' */')
-    _c('')
+    _c_function(self.c_reply_name, 'reply')
     _hc('%s *', self.c_reply_type)
     _hc('%s (xcb_connection_t%s  *c,', self.c_reply_name, spacing1)
     _hc('%s%s   cookie  /**< */,', spacing3, self.c_cookie_type)
@@ -2574,6 +4276,7 @@ def _c_reply(self, name):
 def _c_reply_has_fds(self):
     return any(field.isfd for field in self.fields)
 
+@_profiled
 def _c_reply_fds(self, name):
     '''
     Declares the function that returns fds related to the reply.
@@ -2590,7 +4293,7 @@ def _c_reply_fds(self, name):
     _h(' *')
     _h(' * The returned value must be freed by the caller using free().')
     _h(' */')
-    _c('')
+    _c_function(self.c_reply_fds_name, 'reply')
     _hc('int *')
     _hc('%s (xcb_connection_t%s  *c  /**< */,', self.c_reply_fds_name, spacing1)
     _h('%s%s  *reply);', spacing3, self.c_reply_type)
@@ -2602,10 +4305,14 @@ def _c_reply_fds(self, name):
     _c('}')
 
 
-def _c_opcode(name, opcode):
+def _c_opcode(name, opcode, kind):
     '''
-    Declares the opcode define for requests, events, and errors.
+    Declares the opcode define for requests, events, and errors.  kind is
+    one of the tables in _ctx.names, the name is added to it.
     '''
+    if _ctx.name_tables:
+        _ctx.names[kind][int(opcode)] = name[-1]
+
     _h_setlevel(0)
     _h('')
     _h('/** Opcode for %s. */', _n(name))
@@ -2624,24 +4331,42 @@ def _c_cookie(self, name):
     _h('    unsigned int sequence;')
     _h('} %s;', self.c_cookie_type)
 
+def _man_page(name):
+    '''
+    Returns the OutputFile for a man page; in man-only mode the pages are
+    collected and written all at once by c_close.
+    '''
+    if _ctx.man == 'only':
+        return OutputFile(name, _ctx.man_pages)
+    return OutputFile(name)
+
+@_profiled
 def _man_request(self, name, void, aux):
+    if _ctx.man == 'no':
+        return
+
     param_fields = [f for f in self.fields if f.visible]
 
     func_name = self.c_request_name if not aux else self.c_aux_name
 
     def create_link(linkname):
-        name = 'man/%s.%s' % (linkname, section)
-        if manpaths:
-            sys.stdout.write(name)
-        f = open(name, 'w')
-        f.write('.so man%s/%s.%s' % (section, func_name, section))
+        if _ctx.man == 'only':
+            # just listed in the alias manifest
+            _ctx.man_aliases.append(('%s.%s' % (linkname, _ctx.section),
+                                     '%s.%s' % (func_name, _ctx.section)))
+            return
+        name = 'man/%s.%s' % (linkname, _ctx.section)
+        if _ctx.manpaths:
+            _ctx.manpath_list.append(name)
+        f = OutputFile(name)
+        f.write('.so man%s/%s.%s' % (_ctx.section, func_name, _ctx.section))
         f.close()
 
-    if manpaths:
-        sys.stdout.write('man/%s.%s ' % (func_name, section))
+    if _ctx.manpaths:
+        _ctx.manpath_list.append('man/%s.%s ' % (func_name, _ctx.section))
     # Our CWD is src/, so this will end up in src/man/
-    f = open('man/%s.%s' % (func_name, section), 'w')
-    f.write('.TH %s %s  "%s" "%s" "XCB Requests"\n' % (func_name, section, center_footer, left_footer))
+    f = _man_page('man/%s.%s' % (func_name, _ctx.section))
+    f.write('.TH %s %s  "%s" "%s" "XCB Requests"\n' % (func_name, _ctx.section, _ctx.center_footer, _ctx.left_footer))
     # Left-adjust instead of adjusting to both sides
     f.write('.ad l\n')
     f.write('.SH NAME\n')
@@ -2861,10 +4586,10 @@ def _man_request(self, name, void, aux):
         if hasattr(field, "enum") and field.enum:
             # XXX: why the 'xcb' prefix?
             key = ('xcb', field.enum)
-            if key in enums:
+            if key in _ctx.enums:
                 f.write('One of the following values:\n')
                 f.write('.RS 1i\n')
-                enum = enums[key]
+                enum = _ctx.enums[key]
                 count = len(enum.values)
                 for (enam, eval) in enum.values:
                     count = count - 1
@@ -2916,10 +4641,10 @@ def _man_request(self, name, void, aux):
             if hasattr(field, "enum") and field.enum:
                 # XXX: why the 'xcb' prefix?
                 key = ('xcb', field.enum)
-                if key in enums:
+                if key in _ctx.enums:
                     f.write('One of the following values:\n')
                     f.write('.RS 1i\n')
-                    enum = enums[key]
+                    enum = _ctx.enums[key]
                     count = len(enum.values)
                     for (enam, eval) in enum.values:
                         count = count - 1
@@ -2960,14 +4685,14 @@ def _man_request(self, name, void, aux):
                  'have to be handled in the event loop.\n\nIf you want to '
                  'handle errors directly with \\fIxcb_request_check\\fP '
                  'instead, use \\fI%s_checked\\fP. See '
-                 '\\fBxcb-requests(%s)\\fP for details.\n') % (base_func_name, section))
+                 '\\fBxcb-requests(%s)\\fP for details.\n') % (base_func_name, _ctx.section))
     else:
         f.write(('Returns an \\fI%s\\fP. Errors have to be handled when '
                  'calling the reply function \\fI%s\\fP.\n\nIf you want to '
                  'handle errors in the event loop instead, use '
                  '\\fI%s_unchecked\\fP. See \\fBxcb-requests(%s)\\fP for '
                  'details.\n') %
-                (self.c_cookie_type, self.c_reply_name, base_func_name, section))
+                (self.c_cookie_type, self.c_reply_name, base_func_name, _ctx.section))
     f.write('.SH ERRORS\n')
     if hasattr(self, "doc") and self.doc:
         for errtype, errtext in sorted(self.doc.errors.items()):
@@ -2985,18 +4710,18 @@ def _man_request(self, name, void, aux):
         f.write('.fi\n')
     f.write('.SH SEE ALSO\n')
     if hasattr(self, "doc") and self.doc:
-        see = ['.BR %s (%s)' % ('xcb-requests', section)]
+        see = ['.BR %s (%s)' % ('xcb-requests', _ctx.section)]
         if self.doc.example:
-            see.append('.BR %s (%s)' % ('xcb-examples', section))
+            see.append('.BR %s (%s)' % ('xcb-examples', _ctx.section))
         for seename, seetype in sorted(self.doc.see.items()):
             if seetype == 'program':
                 see.append('.BR %s (1)' % seename)
             elif seetype == 'event':
-                see.append('.BR %s (%s)' % (_t(('xcb', seename, 'event')), section))
+                see.append('.BR %s (%s)' % (_t(('xcb', seename, 'event')), _ctx.section))
             elif seetype == 'request':
-                see.append('.BR %s (%s)' % (_n(('xcb', seename)), section))
+                see.append('.BR %s (%s)' % (_n(('xcb', seename)), _ctx.section))
             elif seetype == 'function':
-                see.append('.BR %s (%s)' % (seename, section))
+                see.append('.BR %s (%s)' % (seename, _ctx.section))
             else:
                 see.append('TODO: %s (type %s)' % (seename, seetype))
         f.write(',\n'.join(see) + '\n')
@@ -3004,12 +4729,16 @@ def _man_request(self, name, void, aux):
     f.write('Generated from %s.xml. Contact xcb@lists.freedesktop.org for corrections and improvements.\n' % _ns.header)
     f.close()
 
+@_profiled
 def _man_event(self, name):
-    if manpaths:
-        sys.stdout.write('man/%s.%s ' % (self.c_type, section))
+    if _ctx.man == 'no':
+        return
+
+    if _ctx.manpaths:
+        _ctx.manpath_list.append('man/%s.%s ' % (self.c_type, _ctx.section))
     # Our CWD is src/, so this will end up in src/man/
-    f = open('man/%s.%s' % (self.c_type, section), 'w')
-    f.write('.TH %s %s  "%s" "%s" "XCB Events"\n' % (self.c_type, section, center_footer, left_footer))
+    f = _man_page('man/%s.%s' % (self.c_type, _ctx.section))
+    f.write('.TH %s %s  "%s" "%s" "XCB Events"\n' % (self.c_type, _ctx.section, _ctx.center_footer, _ctx.left_footer))
     # Left-adjust instead of adjusting to both sides
     f.write('.ad l\n')
     f.write('.SH NAME\n')
@@ -3115,18 +4844,18 @@ def _man_event(self, name):
         f.write('.fi\n')
     f.write('.SH SEE ALSO\n')
     if hasattr(self, "doc") and self.doc:
-        see = ['.BR %s (%s)' % ('xcb_generic_event_t', section)]
+        see = ['.BR %s (%s)' % ('xcb_generic_event_t', _ctx.section)]
         if self.doc.example:
-            see.append('.BR %s (%s)' % ('xcb-examples', section))
+            see.append('.BR %s (%s)' % ('xcb-examples', _ctx.section))
         for seename, seetype in sorted(self.doc.see.items()):
             if seetype == 'program':
                 see.append('.BR %s (1)' % seename)
             elif seetype == 'event':
-                see.append('.BR %s (%s)' % (_t(('xcb', seename, 'event')), section))
+                see.append('.BR %s (%s)' % (_t(('xcb', seename, 'event')), _ctx.section))
             elif seetype == 'request':
-                see.append('.BR %s (%s)' % (_n(('xcb', seename)), section))
+                see.append('.BR %s (%s)' % (_n(('xcb', seename)), _ctx.section))
             elif seetype == 'function':
-                see.append('.BR %s (%s)' % (seename, section))
+                see.append('.BR %s (%s)' % (seename, _ctx.section))
             else:
                 see.append('TODO: %s (type %s)' % (seename, seetype))
         f.write(',\n'.join(see) + '\n')
@@ -3135,6 +4864,9 @@ def _man_event(self, name):
     f.close()
 
 
+@_header_category('requests')
+@_function_group
+@_profiled
 def c_request(self, name):
     '''
     Exported function that handles request declarations.
@@ -3146,7 +4878,7 @@ def c_request(self, name):
         _c_cookie(self, name)
 
     # Opcode define
-    _c_opcode(name, self.opcode)
+    _c_opcode(name, self.opcode, 'request')
 
     # Request structure declaration
     _c_complex(self)
@@ -3185,6 +4917,9 @@ def c_request(self, name):
     _man_request(self, name, void=not self.reply, aux=False)
 
 
+@_header_category('events')
+@_function_group
+@_profiled
 def c_eventstruct(self, name):
     #add fields that are needed to get the event-type in a generic way
     self.fields.append( Field( tevent, tevent.name, 'event_header', False, True, True) )
@@ -3206,6 +4941,9 @@ def c_eventstruct(self, name):
         #TODO: Create sizeof function (and maybe other accessors) for var-sized eventstructs
         raise Exception( 'var sized eventstructs are not yet supported' )
 
+@_header_category('events')
+@_function_group
+@_profiled
 def c_event(self, name):
     '''
     Exported function that handles event declarations.
@@ -3247,7 +4985,8 @@ def c_event(self, name):
         pass
 
     # Opcode define
-    _c_opcode(name, self.opcodes[name])
+    _c_opcode(name, self.opcodes[name],
+              'ge_event' if getattr(self, 'is_ge_event', False) else 'event')
 
     if self.name == name:
         # Structure definition
@@ -3261,10 +5000,10 @@ def c_event(self, name):
         if self.c_need_sizeof:
             _h_setlevel(1)
             _c_setlevel(1)
+            _c_function(_n(name + ('sizeof',)), 'sizeof')
             _h('')
             _h('int')
             _h('%s (const void  *_buffer  /**< */);', _n(name + ('sizeof',)))
-            _c('')
             _c('int')
             _c('%s (const void  *_buffer  /**< */)', _n(name + ('sizeof',)))
             _c('{');
@@ -3275,6 +5014,9 @@ def c_event(self, name):
 
     _man_event(self, name)
 
+@_header_category('errors')
+@_function_group
+@_profiled
 def c_error(self, name):
     '''
     Exported function that handles error declarations.
@@ -3282,7 +5024,7 @@ def c_error(self, name):
     _c_type_setup(self, name, ('error',))
 
     # Opcode define
-    _c_opcode(name, self.opcodes[name])
+    _c_opcode(name, self.opcodes[name], 'error')
 
     if self.name == name:
         # Structure definition
@@ -3308,61 +5050,837 @@ output = {'open'    : c_open,
           'error'   : c_error,
           }
 
-# Boilerplate below this point
-
-# Check for the argument that specifies path to the xcbgen python package.
-try:
-    opts, args = getopt.getopt(sys.argv[1:], 'c:l:s:p:m', ["server-side"])
-except getopt.GetoptError as err:
-    print(err)
-    print('Usage: c_client.py -c center_footer -l left_footer -s section [-p path] file.xml')
-    sys.exit(1)
-
-for (opt, arg) in opts:
-    if opt == '-c':
-        center_footer=arg
-    if opt == '-l':
-        left_footer=arg
-    if opt == '-s':
-        section=arg
-    if opt == '-p':
-        sys.path.insert(1, arg)
-    if opt == '--server-side':
-        config_server_side=True
-    elif opt == '-m':
-        manpaths = True
-        sys.stdout.write('man_MANS = ')
-
-# Import the module class
-try:
-    from xcbgen.state import Module
-    from xcbgen.xtypes import *
-except ImportError:
-    print('''
+# Options understood by generate(), with their default values.
+default_options = {'center_footer' : '',
+                   'left_footer'   : '',
+                   'section'       : '3',
+                   'server_side'   : False,
+                   'manpaths'      : False,
+                   # 'yes': library and man pages, 'no': library only,
+                   # 'only': man pages only, aliases in a manifest
+                   'man'           : 'yes',
+                   # write <header>.d (<header>-man.d with man 'only')
+                   'depfile'       : False,
+                   'dep_target'    : None,
+                   # number of source files per module, or 'kind'
+                   'shards'        : 1,
+                   # names of the elements to generate, see select_subset()
+                   'only'          : None,
+                   # write <header>.symbols, see SymbolReport
+                   'symbol_report' : False,
+                   # list of (pattern, 'hot' or 'cold'), see read_hot_list()
+                   'hot_list'      : None,
+                   # documentation only in <header>-doc.h
+                   'lean_headers'  : False,
+                   # one header per category, see SplitHeaderWriter
+                   'split_headers' : False,
+                   # write <header>.map and define all functions hidden,
+                   # with a public alias
+                   'version_script': False,
+                   # functions that return the names of requests, events,
+                   # errors and enum values
+                   'name_tables'   : False,
+                   # index functions for lists of variable-size elements,
+                   # see _c_index()
+                   'list_index'    : False,
+                   # headers of the modules that are generated as one
+                   # header with inline functions, see HeaderOnlyWriter
+                   'header_only'   : None,
+                   'cache_dir'     : None,
+                   }
+
+def _import_xcbgen(path=None):
+    '''
+    Imports the xcbgen package, optionally from the given directory.
+    Makes the xcbgen classes available as globals of this module, the same
+    way "from xcbgen.xtypes import *" would.
+    '''
+    global Module, tevent
+    if path is not None and path not in sys.path:
+        sys.path.insert(1, path)
+
+    # xcbgen looks up the output dictionary in the __main__ module, which
+    # is not this one when generate() is called from another program.
+    main_module = sys.modules['__main__']
+    if not hasattr(main_module, 'output'):
+        main_module.output = output
+
+    try:
+        import xcbgen.state
+        import xcbgen.xtypes
+    except ImportError:
+        print('''
 Failed to load the xcbgen Python package!
 Make sure that xcb/proto installed it on your Python path.
 If not, you will need to create a .pth file or define $PYTHONPATH
 to extend the path.
 Refer to the README file in xcb/proto for more info.
 ''')
-    raise
+        raise
+
+    Module = xcbgen.state.Module
+    globals().update((k, v) for (k, v) in vars(xcbgen.xtypes).items()
+                     if not k.startswith('_'))
+
+    # predefined datatype globals.
+    tevent = SimpleType(('xcb_raw_generic_event_t',), 32)
+
+def _xml_imports(xml):
+    '''
+    Returns the XML files imported by xml, directly or indirectly.
+    Imports are looked up next to the importing file, like xcbgen does.
+    '''
+    found = []
+    todo = [xml]
+    while todo:
+        path = todo.pop(0)
+        for elt in ElementTree.parse(path).getroot().findall('import'):
+            imported = os.path.join(os.path.dirname(path), elt.text.strip() + '.xml')
+            if imported not in found:
+                found.append(imported)
+                todo.append(imported)
+    return found
+
+def _xml_is_imported(xml):
+    '''
+    Returns whether another XML file in the directory of xml imports it.
+    '''
+    directory = os.path.dirname(xml) or '.'
+    header = os.path.splitext(os.path.basename(xml))[0]
+    for name in sorted(os.listdir(directory)):
+        path = os.path.join(directory, name)
+        if not name.endswith('.xml') or os.path.abspath(path) == os.path.abspath(xml):
+            continue
+        for elt in ElementTree.parse(path).getroot().findall('import'):
+            if elt.text.strip() == header:
+                return True
+    return False
+
+def _files_digest(files):
+    '''
+    Returns a hash over the content of the given files.
+    '''
+    digest = hashlib.sha1()
+    for name in files:
+        digest.update(os.path.basename(name).encode('utf-8'))
+        with open(name, 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+_xcbgen_digest = None
+_generator_digest = None
+
+def _get_xcbgen_digest():
+    '''
+    Returns a hash over the sources of the xcbgen package.
+    '''
+    global _xcbgen_digest
+    if _xcbgen_digest is None:
+        xcbgen_dir = os.path.dirname(sys.modules['xcbgen'].__file__)
+        _xcbgen_digest = _files_digest(sorted(os.path.join(xcbgen_dir, name)
+                                              for name in os.listdir(xcbgen_dir)
+                                              if name.endswith('.py')))
+    return _xcbgen_digest
+
+def _get_generator_digest():
+    '''
+    Returns a hash over the code that generates the output:
+    this file and the sources of the xcbgen package.
+    '''
+    global _generator_digest
+    if _generator_digest is None:
+        this_file = os.path.splitext(os.path.abspath(__file__))[0] + '.py'
+        _generator_digest = _files_digest([this_file]) + _get_xcbgen_digest()
+    return _generator_digest
+
+def _make_escape(path):
+    '''
+    Escapes path for use in a make rule.
+    '''
+    return path.replace('$', '$$').replace('#', '\\#').replace(' ', '\\ ')
+
+def _write_depfile(xml, opts):
+    '''
+    Writes a make dependency file for the current module.  The generated
+    files (or the target given by the dep_target option) depend on xml,
+    all XML files it imports, this file and the xcbgen modules in use.
+    Like with gcc -MP, every dependency gets an empty rule of its own, so
+    that make does not fail when one of them goes away.
+    '''
+    target = opts['dep_target']
+    if target is None:
+        if opts['man'] == 'only':
+            target = 'man/%s.aliases' % _ns.header
+        else:
+            target = '%s.c %s.h' % (_ns.header, _ns.header)
+
+    deps = [xml] + _xml_imports(xml)
+    deps.append(os.path.splitext(__file__)[0] + '.py')
+    deps += sorted(os.path.splitext(module.__file__)[0] + '.py'
+                   for (name, module) in list(sys.modules.items())
+                   if (name == 'xcbgen' or name.startswith('xcbgen.')) and
+                      getattr(module, '__file__', None))
+    deps = [_make_escape(dep) for dep in deps]
+
+    lines = ['%s: %s\n' % (target, ' \\\n  '.join(deps))]
+    for dep in deps:
+        lines.append('\n%s:\n' % dep)
+    name = _ns.header + ('-man.d' if opts['man'] == 'only' else '.d')
+    _write_if_changed(name, ''.join(lines))
+
+def _cache_key(xml, opts):
+    '''
+    Computes the content hash that identifies the output for xml: the
+    generator code, the options, and xml with all its imports.
+    '''
+    digest = hashlib.sha1()
+    digest.update(_get_generator_digest().encode('ascii'))
+    digest.update(repr(sorted((k, v) for (k, v) in opts.items() if k != 'cache_dir')).encode('utf-8'))
+    digest.update(_files_digest([xml] + _xml_imports(xml)).encode('ascii'))
+    return digest.hexdigest()
 
-# predefined datatype globals.
-tevent = SimpleType(('xcb_raw_generic_event_t',), 32)
+class _ModulePickler(pickle.Pickler):
+    '''
+    Pickler for resolved xcbgen modules.  The output handlers of this file
+    are stored by name, so that a cached module can be loaded no matter
+    under which name this file was imported.  The builtin types of xcbgen
+    and everything the module has from the modules in shared, a list of
+    (cache name, module) of its imports, are stored as references, so
+    every module is pickled only once.
+    '''
+    def __init__(self, file, shared=()):
+        pickle.Pickler.__init__(self, file, pickle.HIGHEST_PROTOCOL)
+        # id -> persistent id of the objects stored as references
+        self.refs = {}
+        for (name, obj) in vars(sys.modules['xcbgen.xtypes']).items():
+            if isinstance(obj, SimpleType):
+                self.refs[id(obj)] = ('xtypes', name)
+        for (cache_name, module) in shared:
+            self.refs.setdefault(id(module.namespace), (cache_name, 'namespace', None))
+            for table in ('types', 'events', 'errors'):
+                for (key, (name, item)) in getattr(module, table).items():
+                    self.refs.setdefault(id(item), (cache_name, table, key))
+
+    def persistent_id(self, obj):
+        ref = self.refs.get(id(obj))
+        if ref is not None:
+            return ref
+        if obj is output:
+            return 'output'
+        for (key, handler) in output.items():
+            if obj is handler:
+                return 'output:' + key
+        return None
+
+class _ModuleUnpickler(pickle.Unpickler):
+    '''
+    Unpickler for modules pickled by _ModulePickler.  References to other
+    modules are loaded through cache, a _ModuleCache.
+    '''
+    def __init__(self, file, cache=None):
+        pickle.Unpickler.__init__(self, file)
+        self.cache = cache
+
+    def persistent_load(self, pid):
+        if pid == 'output':
+            return output
+        if not isinstance(pid, tuple):
+            return output[pid[len('output:'):]]
+        if pid[0] == 'xtypes':
+            return getattr(sys.modules['xcbgen.xtypes'], pid[1])
+        (cache_name, table, key) = pid
+        module = self.cache.get(cache_name)
+        if table == 'namespace':
+            return module.namespace
+        return getattr(module, table)[key][1]
+
+# Part of the cache file names, to be changed with the way modules are
+# pickled
+_module_cache_format = '2'
+
+class _ModuleCache(object):
+    '''
+    Loads resolved xcbgen modules through the cache directory, if not
+    None, and in watch mode through _module_memo.  Every XML file is
+    cached on its own, keyed by a hash over the xcbgen sources, the file
+    and the files it imports.  What a module has from its imports is
+    stored as references into their cache entries, so e.g. xproto is
+    resolved and stored only once, and not again with every extension.
+
+    xcbgen executes the imported files as part of the importing module.
+    Instead, the imports are loaded as modules of their own, through the
+    cache, and their tables are merged into the importing module.  The
+    modules loaded by one instance share the modules they import.
+    '''
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        # cache name -> module
+        self.loaded = {}
+
+    def cache_name(self, xml):
+        digest = hashlib.sha1()
+        digest.update(('%d.%d' % sys.version_info[:2]).encode('ascii'))
+        digest.update(_module_cache_format.encode('ascii'))
+        digest.update(_get_xcbgen_digest().encode('ascii'))
+        digest.update(_files_digest([xml] + _xml_imports(xml)).encode('ascii'))
+        return '%s-%s' % (os.path.splitext(os.path.basename(xml))[0], digest.hexdigest())
+
+    def load(self, xml):
+        '''
+        Returns the resolved module of xml.
+        '''
+        name = self.cache_name(xml)
+        module = self.loaded.get(name)
+        if module is None:
+            module = self.read(name)
+        if module is None:
+            module = self.build(xml, name)
+        self.loaded[name] = module
+        return module
+
+    def get(self, name):
+        '''
+        Returns the module with the cache name, which must be cached.
+        '''
+        module = self.loaded.get(name)
+        if module is None:
+            module = self.read(name)
+            if module is None:
+                raise pickle.UnpicklingError('%s is not cached' % name)
+            self.loaded[name] = module
+        return module
+
+    def read(self, name):
+        if _module_memo is not None and name in _module_memo:
+            return _ModuleUnpickler(io.BytesIO(_module_memo[name]), self).load()
+        if self.cache_dir is None:
+            return None
+        path = os.path.join(self.cache_dir, name + '.pickle')
+        try:
+            with open(path, 'rb') as f:
+                return _ModuleUnpickler(f, self).load()
+        except IOError:
+            return None
+        except Exception as e:
+            print('Ignoring unusable module cache %s: %s' % (path, e), file=sys.stderr)
+            return None
+
+    def build(self, xml, name):
+        # Parse the xml header
+        module = Module(xml, output)
+
+        # Build type-registry and resolve type dependencies
+        self.register(module)
+        module.resolve()
+
+        self.write(name, module)
+        return module
+
+    def register(self, module):
+        '''
+        Does what module.register() does, i.e. xcbgen.matcher.execute(),
+        but handles the imports with import_().  The handlers of
+        xcbgen.matcher are looked up, not replaced.
+        '''
+        funcs = sys.modules['xcbgen.matcher'].funcs
+        for elt in list(module.namespace.root):
+            handler = self.import_ if elt.tag == 'import' else funcs[elt.tag]
+            handler(elt, module, module.namespace)
+
+    def import_(self, node, module, namespace):
+        '''
+        Stands in for the import handler of xcbgen.matcher.  Does what
+        executing the imported file would do.
+        '''
+        imported = self.load(os.path.join(namespace.dir, '%s.xml' % node.text))
+        module.import_level = module.import_level + 1
+        for elt in imported.namespace.root.findall('import'):
+            self.import_(elt, module, imported.namespace)
+        for (key, entry) in imported.types.items():
+            if key not in module.types:
+                module.types[key] = entry
+        module.events.update(imported.events)
+        module.errors.update(imported.errors)
+        module.import_level = module.import_level - 1
+        if not module.has_import(node.text):
+            module.add_import(node.text, imported.namespace)
+
+    def write(self, name, module):
+        '''
+        Stores module in the cache directory and the memo.  Failing to do
+        so only costs time next run, so it is reported and otherwise
+        ignored.
+        '''
+        by_header = dict((loaded.namespace.header, (loaded_name, loaded))
+                         for (loaded_name, loaded) in self.loaded.items())
+        shared = [by_header[header] for (n, header) in module.imports if header in by_header]
+        try:
+            data = io.BytesIO()
+            _ModulePickler(data, shared).dump(module)
+            data = data.getvalue()
+        except (pickle.PicklingError, AttributeError, RuntimeError, TypeError) as e:
+            # e.g. too deeply nested for the pickler; go without the cache
+            print('Cannot cache module %s: %s' % (module.namespace.path, e), file=sys.stderr)
+            return
+
+        if _module_memo is not None:
+            # older versions of the module are not needed any more
+            base = name.rsplit('-', 1)[0]
+            for old in [old for old in _module_memo if old.rsplit('-', 1)[0] == base]:
+                del _module_memo[old]
+            _module_memo[name] = data
+        if self.cache_dir is None:
+            return
+
+        path = os.path.join(self.cache_dir, name + '.pickle')
+        tmp_path = None
+        try:
+            try:
+                os.makedirs(self.cache_dir)
+            except OSError as e:
+                if e.errno != errno.EEXIST:
+                    raise
+            # a file of its own, other processes may store the same module
+            (fd, tmp_path) = tempfile.mkstemp(prefix=name, suffix='.tmp', dir=self.cache_dir)
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            # os.rename() replaces atomically, but not on Windows
+            getattr(os, 'replace', os.rename)(tmp_path, path)
+        except (OSError, IOError) as e:
+            print('Cannot cache module %s: %s' % (module.namespace.path, e), file=sys.stderr)
+            if tmp_path is not None and os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+# In watch mode: cache name -> pickled resolved module, see _ModuleCache
+_module_memo = None
+
+@_profiled
+def _load_module(xml, opts):
+    '''
+    Parses xml, then registers and resolves all types of the module and
+    of its imports.  If the cache_dir option is set, or in watch mode,
+    this goes through a _ModuleCache.
+    '''
+    if opts['cache_dir'] is not None or _module_memo is not None:
+        return _ModuleCache(opts['cache_dir']).load(xml)
 
-# Ensure the man subdirectory exists
-try:
-    os.mkdir('man')
-except OSError as e:
-    if e.errno != errno.EEXIST:
+    # Parse the xml header
+    module = Module(xml, output)
+
+    # Build type-registry and resolve type dependencies
+    module.register()
+    module.resolve()
+    return module
+
+# Cache stamp file name suffix per value of the man option
+_stamp_suffixes = {'yes' : '.stamp',
+                   'no' : '-lib.stamp',
+                   'only' : '-man.stamp'}
+
+def _read_cache_stamp(path):
+    '''
+    Returns the content of a cache stamp file, or None if there is none.
+    '''
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return None
+
+def _write_cache_stamp(path, stamp):
+    '''
+    Atomically replaces the cache stamp file path.  Failing to do so only
+    means the module is generated again next time, so it is reported and
+    otherwise ignored.
+    '''
+    tmp_path = None
+    try:
+        try:
+            os.makedirs(os.path.dirname(path))
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+        (fd, tmp_path) = tempfile.mkstemp(prefix=os.path.basename(path), suffix='.tmp',
+                                          dir=os.path.dirname(path))
+        with os.fdopen(fd, 'w') as f:
+            json.dump(stamp, f, indent=1, sort_keys=True)
+        # os.rename() replaces atomically, but not on Windows
+        getattr(os, 'replace', os.rename)(tmp_path, path)
+    except (OSError, IOError) as e:
+        print('Cannot write cache stamp %s: %s' % (path, e), file=sys.stderr)
+        if tmp_path is not None and os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+def generate(xml, outdir='.', options=None, profile=None):
+    '''
+    Generates the C header, C source and man pages for one XML protocol
+    description.  The files are written to outdir (man pages to its man/
+    subdirectory).  options is a dict overriding entries of default_options.
+    Returns the list of man page paths if the manpaths option is set.
+
+    If profile is a list, one dict per profiled function and protocol
+    element is appended to it, see Profiler.
+
+    If the cache_dir option is set, a stamp with a content hash over all
+    inputs is kept there for every module, and the module is not generated
+    again as long as the hash and the generated files stay the same.
+    '''
+    global _ctx, _ns, config_server_side
+
+    if 'Module' not in globals():
+        _import_xcbgen()
+
+    opts = dict(default_options)
+    if options is not None:
+        opts.update(options)
+    config_server_side = opts['server_side']
+
+    cache_stamp = None
+    if opts['cache_dir'] is not None:
+        key = _cache_key(xml, opts)
+        # library-only and man-only runs of a module have stamps of their own
+        cache_stamp = os.path.join(opts['cache_dir'],
+                                   os.path.splitext(os.path.basename(xml))[0] +
+                                   _stamp_suffixes[opts['man']])
+        stamp = _read_cache_stamp(cache_stamp)
+        if (stamp is not None and stamp['key'] == key and
+            all(os.path.exists(os.path.join(outdir, name)) for name in stamp['outputs'])):
+            return stamp['manpaths']
+
+    # Ensure the output directory and its man subdirectory exist
+    try:
+        if opts['man'] == 'no':
+            os.makedirs(outdir)
+        else:
+            os.makedirs(os.path.join(outdir, 'man'))
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+
+    ctx = GenContext(outdir, opts)
+    if profile is not None:
+        ctx.profiler = Profiler()
+    _ctx = ctx
+    try:
+        ctx.module = _load_module(xml, opts)
+
+        # Output the code
+        ctx.module.generate()
+
+        if opts['depfile']:
+            _write_depfile(xml, opts)
+    except Exception:
+        # hfile and cfile can consist of many files, some of them opened
+        # before the failure in a constructor
+        for writer in ctx.writers:
+            writer.discard()
         raise
+    finally:
+        # Drop the module right away, it can be large
+        ctx.module = None
+        _ctx = None
+        _ns = None
+
+    if profile is not None:
+        module = os.path.splitext(os.path.basename(xml))[0]
+        for ((function, element), record) in sorted(ctx.profiler.records.items()):
+            profile.append({'module' : module,
+                            'function' : function,
+                            'element' : element,
+                            'calls' : record[0],
+                            'seconds' : record[1],
+                            'lines' : record[2],
+                            'bytes' : record[3]})
+
+    if cache_stamp is not None:
+        _write_cache_stamp(cache_stamp, {'key' : key,
+                                         'outputs' : ctx.outputs,
+                                         'manpaths' : ctx.manpath_list})
+
+    return ctx.manpath_list
+
+def _generate_job(job):
+    '''
+    Process pool worker: generates one module, see generate().
+    '''
+    (xml, outdir, options, profiled) = job
+    profile = None
+    if profiled:
+        profile = []
+    return (generate(xml, outdir, options, profile), profile)
+
+def generate_all(xmls, outdir='.', options=None, jobs=1, xcbgen_path=None, profile=None):
+    '''
+    Generates several modules, spreading them over a pool of jobs worker
+    processes.  The biggest modules are started first to balance the load.
+    Returns the results of generate() in the order of xmls, no matter in
+    which order the workers finish.  The profiles of all modules are
+    collected in profile, if that is a list.
+    '''
+    job_list = [(xml, outdir, options, profile is not None) for xml in xmls]
+    if jobs <= 1 or len(job_list) <= 1:
+        return _collect_results([_generate_job(job) for job in job_list], profile)
+
+    order = sorted(range(len(job_list)), key=lambda i: -os.path.getsize(xmls[i]))
+    pool = multiprocessing.Pool(min(jobs, len(job_list)), _import_xcbgen, (xcbgen_path,))
+    try:
+        pending = [(i, pool.apply_async(_generate_job, (job_list[i],))) for i in order]
+        results = [None] * len(job_list)
+        for (i, result) in pending:
+            results[i] = result.get()
+    finally:
+        pool.close()
+        pool.join()
+    return _collect_results(results, profile)
+
+def _collect_results(results, profile):
+    '''
+    Splits the (result, profile) pairs of _generate_job() into the list of
+    results and the combined profile.
+    '''
+    for (result, job_profile) in results:
+        if profile is not None:
+            profile.extend(job_profile)
+    return [result for (result, job_profile) in results]
 
-# Parse the xml header
-module = Module(args[0], output)
+def write_profile(profile, path, top=20, out=sys.stderr):
+    '''
+    Writes profile as JSON to path, and a table of the top slowest
+    protocol elements plus the totals per function to out.
+    '''
+    with open(path, 'w') as f:
+        json.dump(profile, f, indent=1, sort_keys=True)
+
+    row = '%-24s %-40s %7s %10s %9s %10s\n'
+    header = row % ('function', 'element', 'calls', 'ms', 'lines', 'bytes')
+
+    out.write('Slowest protocol elements:\n')
+    out.write(header)
+    elements = [r for r in profile if r['element']]
+    elements.sort(key=lambda r: -r['seconds'])
+    for r in elements[:top]:
+        out.write(row % (r['function'], '%s:%s' % (r['module'], r['element']), r['calls'],
+                         '%.2f' % (r['seconds'] * 1000), r['lines'], r['bytes']))
+
+    totals = {}
+    for r in profile:
+        total = totals.setdefault(r['function'], [0, 0.0, 0, 0])
+        total[0] += r['calls']
+        total[1] += r['seconds']
+        total[2] += r['lines']
+        total[3] += r['bytes']
+    out.write('\nTotals per function:\n')
+    out.write(header)
+    for (function, total) in sorted(totals.items(), key=lambda item: -item[1][1]):
+        out.write(row % (function, '', total[0], '%.2f' % (total[1] * 1000), total[2], total[3]))
+
+def _mtime(path):
+    '''
+    Returns the modification time of path, None if it does not exist.
+    '''
+    try:
+        return os.stat(path).st_mtime
+    except OSError:
+        return None
 
-# Build type-registry and resolve type dependencies
-module.register()
-module.resolve()
+def watch(xmls, outdir='.', options=None, interval=0.5):
+    '''
+    Generates all modules, then watches their XML files and everything they
+    import, and regenerates the modules affected by a change, until
+    interrupted.  The resolved modules are kept in memory, each on its own,
+    so only the modules whose input changed are parsed and resolved again,
+    and not the unchanged modules they import.  Errors are reported, but
+    do not stop watching.
+    '''
+    global _module_memo
+    if _module_memo is None:
+        _module_memo = {}
+
+    inputs = {}
+    mtimes = {}
+    pending = list(xmls)
+    while True:
+        for xml in pending:
+            start = time.time()
+            try:
+                inputs[xml] = [xml] + _xml_imports(xml)
+            except Exception:
+                # not even well-formed; watch the file itself until it is
+                inputs[xml] = [xml]
+            for path in inputs[xml]:
+                mtimes[path] = _mtime(path)
+            try:
+                generate(xml, outdir, options)
+                print('Generated %s in %.3f s' % (xml, time.time() - start))
+            except Exception:
+                print('Generating %s failed:' % xml, file=sys.stderr)
+                traceback.print_exc()
+            sys.stdout.flush()
+
+        pending = []
+        while not pending:
+            time.sleep(interval)
+            changed = set(path for path in mtimes if _mtime(path) != mtimes[path])
+            pending = [xml for xml in xmls if changed.intersection(inputs[xml])]
+
+def read_manifest(path):
+    '''
+    Reads the names for the only option from a file: one name per line,
+    '#' starts a comment.  Only the last word of a line is used, so the
+    output of nm can be used as it is.
+    '''
+    names = []
+    with open(path) as f:
+        for line in f:
+            words = line.split('#', 1)[0].split()
+            if words:
+                names.append(words[-1])
+    return names
+
+def read_hot_list(path):
+    '''
+    Reads a hot list: one C function name or fnmatch pattern per line,
+    prefixed with '!' for cold functions; '#' starts a comment.
+    Returns a list of (pattern, 'hot' or 'cold').
+    '''
+    hot_list = []
+    with open(path) as f:
+        for line in f:
+            line = line.split('#', 1)[0].strip()
+            if line.startswith('!'):
+                hot_list.append((line[1:].strip(), 'cold'))
+            elif line:
+                hot_list.append((line, 'hot'))
+    return hot_list
+
+def usage():
+    print('Usage: c_client.py -c center_footer -l left_footer -s section [-p path] [-o outdir]\n'
+          '                   [-j jobs] [--cache-dir dir] [--no-man | --man-only]\n'
+          '                   [--depfile [--dep-target target]] [--shards n|kind]\n'
+          '                   [--only name,... | --manifest file] [--symbol-report]\n'
+          '                   [--hot-list file] [--lean-headers] [--split-headers]\n'
+          '                   [--version-script] [--name-tables] [--list-index]\n'
+          '                   [--header-only name,...]\n'
+          '                   [--profile file.json [--profile-top n]]\n'
+          '                   [--watch [--watch-interval s]] file.xml...')
+    sys.exit(1)
+
+def main(argv):
+    '''
+    Command line entry point.  All XML files given on the command line are
+    generated, one after the other unless -j asks for more jobs.  Running
+    on all cores by default would oversubscribe the machine under make -j.
+    '''
+    options = dict(default_options)
+    outdir = '.'
+    xcbgen_path = None
+    jobs = 1
+    profile_path = None
+    profile_top = 20
+    only = set()
+    watch_interval = None
+
+    # Check for the argument that specifies path to the xcbgen python package.
+    try:
+        opts, args = getopt.getopt(argv, 'c:l:s:p:mo:j:',
+                                   ["server-side", "jobs=", "cache-dir=",
+                                    "profile=", "profile-top=", "no-man", "man-only",
+                                    "depfile", "dep-target=", "shards=",
+                                    "only=", "manifest=", "watch", "watch-interval=",
+                                    "symbol-report", "hot-list=", "lean-headers",
+                                    "split-headers", "version-script",
+                                    "name-tables", "list-index", "header-only="])
+    except getopt.GetoptError as err:
+        print(err)
+        usage()
+
+    for (opt, arg) in opts:
+        if opt == '-c':
+            options['center_footer'] = arg
+        if opt == '-l':
+            options['left_footer'] = arg
+        if opt == '-s':
+            options['section'] = arg
+        if opt == '-p':
+            xcbgen_path = arg
+        if opt == '-o':
+            outdir = arg
+        if opt in ('-j', '--jobs'):
+            jobs = int(arg)
+        if opt == '--cache-dir':
+            options['cache_dir'] = arg
+        if opt == '--profile':
+            profile_path = arg
+        if opt == '--profile-top':
+            profile_top = int(arg)
+        if opt == '--no-man':
+            options['man'] = 'no'
+        if opt == '--man-only':
+            options['man'] = 'only'
+        if opt == '--depfile':
+            options['depfile'] = True
+        if opt == '--dep-target':
+            options['dep_target'] = arg
+        if opt == '--shards':
+            options['shards'] = arg if arg == 'kind' else int(arg)
+        if opt == '--only':
+            only.update(arg.split(','))
+        if opt == '--manifest':
+            only.update(read_manifest(arg))
+        if opt == '--watch':
+            watch_interval = watch_interval or 0.5
+        if opt == '--watch-interval':
+            watch_interval = float(arg)
+        if opt == '--header-only':
+            options['header_only'] = arg.split(',')
+        if opt == '--name-tables':
+            options['name_tables'] = True
+        if opt == '--list-index':
+            options['list_index'] = True
+        if opt == '--version-script':
+            options['version_script'] = True
+        if opt == '--split-headers':
+            options['split_headers'] = True
+        if opt == '--lean-headers':
+            options['lean_headers'] = True
+        if opt == '--hot-list':
+            options['hot_list'] = read_hot_list(arg)
+        if opt == '--symbol-report':
+            options['symbol_report'] = True
+        if opt == '--server-side':
+            options['server_side'] = True
+        elif opt == '-m':
+            options['manpaths'] = True
+
+    if only:
+        options['only'] = sorted(only)
+
+    if len(args) == 0:
+        usage()
+
+    # Import the module class
+    _import_xcbgen(xcbgen_path)
+
+    if watch_interval is not None:
+        try:
+            watch(args, outdir, options, watch_interval)
+        except KeyboardInterrupt:
+            pass
+        return
+
+    profile = None
+    if profile_path is not None:
+        profile = []
+
+    results = generate_all(args, outdir, options, jobs, xcbgen_path, profile)
+
+    if profile is not None:
+        write_profile(profile, profile_path, profile_top)
+
+    if options['manpaths']:
+        sys.stdout.write('man_MANS = ')
+        for manpath_list in results:
+            sys.stdout.write(''.join(manpath_list))
 
-# Output the code
-module.generate()
+if __name__ == '__main__':
+    main(sys.argv[1:])
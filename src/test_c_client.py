@@ -0,0 +1,774 @@
+#!/usr/bin/env python
+'''
+Tests for c_client.py.
+
+The tests that generate code need the xcbgen package of xcb-proto.  They
+are skipped if it cannot be imported, from the Python path or from the
+directory given in $XCBPROTO_XCBPYTHONDIR.  The tests that compile the
+generated code also need xproto.xml from $XCBPROTO_XCBINCLUDEDIR and the C
+compiler in $CC (default cc).
+'''
+from __future__ import print_function
+import errno
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import c_client
+
+def _have_xcbgen():
+    path = os.environ.get('XCBPROTO_XCBPYTHONDIR')
+    if path and path not in sys.path:
+        sys.path.insert(1, path)
+    try:
+        import xcbgen
+    except ImportError:
+        return False
+    c_client._import_xcbgen(path)
+    return True
+
+have_xcbgen = _have_xcbgen()
+
+_smoke_xml = '''<?xml version="1.0" encoding="utf-8"?>
+<xcb header="smoke" extension-xname="SMOKE" extension-name="Smoke"
+     major-version="1" minor-version="0">
+  <xidtype name="Thing" />
+  <struct name="Item">
+    <field type="CARD16" name="id" />
+    <field type="CARD16" name="name_len" />
+    <list type="char" name="name"><fieldref>name_len</fieldref></list>
+  </struct>
+  <request name="GetItems" opcode="0">
+    <field type="CARD32" name="window" />
+    <reply>
+      <pad bytes="1" />
+      <field type="CARD32" name="items_len" />
+      <pad bytes="20" />
+      <list type="Item" name="items"><fieldref>items_len</fieldref></list>
+    </reply>
+  </request>
+  <request name="SetValue" opcode="1">
+    <field type="Thing" name="thing" />
+    <field type="CARD32" name="value" />
+  </request>
+  <event name="Changed" number="0">
+    <field type="CARD8" name="detail" />
+    <field type="CARD32" name="value" />
+  </event>
+  <error name="BadItem" number="0" />
+</xcb>
+'''
+
+class GeneratorTestCase(unittest.TestCase):
+    '''
+    Base class of the tests that generate modules in a temporary directory.
+    '''
+    def setUp(self):
+        if not have_xcbgen:
+            self.skipTest('xcbgen is not available')
+        self.tmpdir = tempfile.mkdtemp(prefix='test_c_client')
+        self.outdir = os.path.join(self.tmpdir, 'out')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir, True)
+
+    def write_xml(self, name, text):
+        path = os.path.join(self.tmpdir, name)
+        with open(path, 'w') as f:
+            f.write(text)
+        return path
+
+    def read_output(self, name):
+        with open(os.path.join(self.outdir, name)) as f:
+            return f.read()
+
+    def copy_xproto(self):
+        '''
+        Copies xproto.xml of xcb-proto to the temporary directory, next to
+        the XML files of the test that import it.
+        '''
+        directory = os.environ.get('XCBPROTO_XCBINCLUDEDIR')
+        path = directory and os.path.join(directory, 'xproto.xml')
+        if not path or not os.path.exists(path):
+            self.skipTest('xproto.xml is not available')
+        shutil.copy(path, self.tmpdir)
+        return os.path.join(self.tmpdir, 'xproto.xml')
+
+    def compile(self, name):
+        '''
+        Compiles the file name of the output directory.  The headers of
+        libxcb are copied there first, so that xcb.h includes the generated
+        xproto.h.
+        '''
+        srcdir = os.path.dirname(os.path.abspath(c_client.__file__))
+        for header in ('xcb.h', 'xcb_base.h', 'xcbext.h'):
+            shutil.copy(os.path.join(srcdir, header), self.outdir)
+        command = os.environ.get('CC', 'cc').split()
+        command.extend(['-c', '-I', self.outdir, '-o', os.path.join(self.tmpdir, 'test.o'),
+                        os.path.join(self.outdir, name)])
+        try:
+            proc = subprocess.Popen(command, stdout=subprocess.PIPE,
+                                    stderr=subprocess.STDOUT)
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+            self.skipTest('no C compiler')
+        output = proc.communicate()[0]
+        self.assertEqual(proc.returncode, 0, output.decode('utf-8', 'replace'))
+
+class GenerateTest(GeneratorTestCase):
+    def test_request(self):
+        xml = self.write_xml('smoke.xml', _smoke_xml)
+        c_client.generate(xml, self.outdir, {'man' : 'no'})
+        header = self.read_output('smoke.h')
+        source = self.read_output('smoke.c')
+        for name in ('xcb_smoke_get_items', 'xcb_smoke_get_items_unchecked',
+                     'xcb_smoke_get_items_reply', 'xcb_smoke_set_value_checked',
+                     'xcb_smoke_get_items_items_iterator'):
+            self.assertTrue('\n%s (' % name in header, name)
+            self.assertTrue('\n%s (' % name in source, name)
+        self.assertTrue('xcb_smoke_changed_event_t;' in header)
+
+    def test_profile(self):
+        xml = self.write_xml('smoke.xml', _smoke_xml)
+        profile = []
+        c_client.generate(xml, self.outdir, {'man' : 'no'}, profile)
+        functions = set(record['function'] for record in profile)
+        self.assertTrue('_c_request_helper' in functions)
+
+class _Failure(Exception):
+    pass
+
+class FailureTest(GeneratorTestCase):
+    def test_discard(self):
+        section_writer = c_client.SectionWriter
+        class FailingWriter(section_writer):
+            def __init__(self, name):
+                if name == 'smoke_2.c':
+                    raise _Failure()
+                section_writer.__init__(self, name)
+        c_client.SectionWriter = FailingWriter
+        try:
+            xml = self.write_xml('smoke.xml', _smoke_xml)
+            # fails after the header, the private header and two of the
+            # shards are opened
+            self.assertRaises(_Failure, c_client.generate, xml, self.outdir,
+                              {'man' : 'no', 'shards' : 3, 'lean_headers' : True})
+        finally:
+            c_client.SectionWriter = section_writer
+        # neither the generated files nor their temporary files are left
+        self.assertEqual(os.listdir(self.outdir), [])
+
+class HeaderOnlyTest(GeneratorTestCase):
+    def test_compile_with_xproto(self):
+        xproto = self.copy_xproto()
+        xml = self.write_xml('smoke.xml', _window_xml)
+        c_client.generate(xproto, self.outdir, {'man' : 'no'})
+        c_client.generate(xml, self.outdir, {'man' : 'no', 'header_only' : ['smoke']})
+        self.assertFalse(os.path.exists(os.path.join(self.outdir, 'smoke.c')))
+        with open(os.path.join(self.outdir, 'use.c'), 'w') as f:
+            f.write('#include "smoke.h"\n')
+        self.compile('use.c')
+
+    def test_core_module(self):
+        xproto = self.copy_xproto()
+        self.assertRaises(Exception, c_client.generate, xproto, self.outdir,
+                          {'man' : 'no', 'header_only' : ['xproto']})
+        self.assertEqual(os.listdir(self.outdir), [])
+
+class SplitHeadersTest(GeneratorTestCase):
+    def test_compile_category(self):
+        xproto = self.copy_xproto()
+        xml = self.write_xml('smoke.xml', _window_xml)
+        options = {'man' : 'no', 'split_headers' : True}
+        c_client.generate(xproto, self.outdir, options)
+        c_client.generate(xml, self.outdir, options)
+        with open(os.path.join(self.outdir, 'use.c'), 'w') as f:
+            f.write('#include "smoke_requests.h"\n'
+                    '#ifdef __XCB_H__\n'
+                    '#error xcb.h is included\n'
+                    '#endif\n')
+        self.compile('use.c')
+        self.compile('smoke.c')
+
+class SubsetTest(GeneratorTestCase):
+    def test_only(self):
+        xml = self.write_xml('smoke.xml', _smoke_xml)
+        c_client.generate(xml, self.outdir, {'man' : 'no', 'only' : ['xcb_smoke_set_value']})
+        header = self.read_output('smoke.h')
+        self.assertTrue('xcb_smoke_set_value_checked (' in header)
+        # the xidtype of a field is kept, it shares its type with CARD32
+        self.assertTrue('typedef uint32_t xcb_smoke_thing_t;' in header)
+        self.assertFalse('xcb_smoke_get_items' in header)
+        self.assertFalse('xcb_smoke_item_t' in header)
+
+    def test_imported_module(self):
+        base = self.write_xml('base.xml', _base_xml)
+        xml = self.write_xml('smoke.xml', _importing_xml)
+        self.assertTrue(c_client._xml_is_imported(base))
+        self.assertFalse(c_client._xml_is_imported(xml))
+
+    def test_compile_with_xproto(self):
+        xproto = self.copy_xproto()
+        xml = self.write_xml('smoke.xml', _window_xml)
+        options = {'man' : 'no', 'only' : ['xcb_smoke_watch']}
+        c_client.generate(xproto, self.outdir, options)
+        c_client.generate(xml, self.outdir, options)
+        header = self.read_output('smoke.h')
+        self.assertTrue('xcb_smoke_watch (' in header)
+        self.assertFalse('xcb_smoke_add_item' in header)
+        # xproto is not trimmed: libxcb and the extension use its types
+        self.assertTrue('} xcb_screen_t;' in self.read_output('xproto.h'))
+        self.compile('smoke.c')
+
+_window_xml = '''<?xml version="1.0" encoding="utf-8"?>
+<xcb header="smoke" extension-xname="SMOKE" extension-name="Smoke"
+     major-version="1" minor-version="0">
+  <import>xproto</import>
+  <struct name="Item">
+    <field type="CARD16" name="id" />
+  </struct>
+  <request name="Watch" opcode="0">
+    <field type="WINDOW" name="window" />
+    <field type="ATOM" name="property" />
+  </request>
+  <request name="AddItem" opcode="1">
+    <field type="Item" name="item" />
+  </request>
+</xcb>
+'''
+
+class VersionScriptTest(GeneratorTestCase):
+    def test_map(self):
+        xml = self.write_xml('smoke.xml', _smoke_xml)
+        c_client.generate(xml, self.outdir, {'man' : 'no', 'version_script' : True})
+        script = self.read_output('smoke.map')
+        self.assertTrue('\txcb_smoke_get_items_reply;\n' in script)
+        self.assertTrue('\txcb_smoke_id;\n' in script)
+        self.assertTrue('local:\n\t*;\n};' in script)
+        source = self.read_output('smoke.c')
+        self.assertTrue('XCB_HIDDEN_PROTO(xcb_smoke_get_items_reply)' in source)
+        self.assertTrue('XCB_HIDDEN_ALIAS(xcb_smoke_get_items_reply)' in source)
+
+    def test_core_module(self):
+        # libxcb also contains the hand-written API, the core protocol gets
+        # no script that would hide it
+        xml = self.write_xml('base.xml', _base_xml)
+        c_client.generate(xml, self.outdir, {'man' : 'no', 'version_script' : True})
+        self.assertFalse(os.path.exists(os.path.join(self.outdir, 'base.map')))
+        self.assertTrue('XCB_HIDDEN_PROTO(xcb_pair_next)' in self.read_output('base.c'))
+
+_enum_xml = '''<?xml version="1.0" encoding="utf-8"?>
+<xcb header="smoke" extension-xname="SMOKE" extension-name="Smoke"
+     major-version="1" minor-version="0">
+  <enum name="Mode">
+    <item name="Zero"><value>0</value></item>
+    <item name="Ten"><value>010</value></item>
+    <item name="Hex"><value>0x20</value></item>
+    <item name="Next" />
+  </enum>
+  <request name="ModeName" opcode="0">
+    <field type="CARD32" name="mode" enum="Mode" />
+  </request>
+</xcb>
+'''
+
+class NameTablesTest(GeneratorTestCase):
+    def test_off_by_default(self):
+        xml = self.write_xml('smoke.xml', _smoke_xml)
+        c_client.generate(xml, self.outdir, {'man' : 'no'})
+        self.assertFalse('xcb_smoke_request_name' in self.read_output('smoke.h'))
+
+    def test_enum(self):
+        xml = self.write_xml('smoke.xml', _enum_xml)
+        c_client.generate(xml, self.outdir, {'man' : 'no', 'name_tables' : True})
+        header = self.read_output('smoke.h')
+        source = self.read_output('smoke.c')
+        # the request takes the name, so the enum table gets another one
+        self.assertTrue('\nxcb_smoke_mode_value_name (uint32_t value);' in header)
+        # 010 is octal in C: 0, 8, 32, 33 is too sparse for a direct table
+        self.assertTrue('    0U, 8U, 32U, 33U,' in source)
+
+    def test_c_integer(self):
+        self.assertEqual(c_client._c_integer('0'), 0)
+        self.assertEqual(c_client._c_integer('10'), 10)
+        self.assertEqual(c_client._c_integer('010'), 8)
+        self.assertEqual(c_client._c_integer('0x1F'), 31)
+        self.assertEqual(c_client._c_integer('-0x10'), -16)
+        self.assertEqual(c_client._c_integer('4294967295U'), 4294967295)
+
+class ListIndexTest(GeneratorTestCase):
+    def test_off_by_default(self):
+        xml = self.write_xml('smoke.xml', _smoke_xml)
+        c_client.generate(xml, self.outdir, {'man' : 'no'})
+        self.assertFalse('xcb_smoke_item_index_t' in self.read_output('smoke.h'))
+
+    def test_index(self):
+        xml = self.write_xml('smoke.xml', _smoke_xml)
+        c_client.generate(xml, self.outdir, {'man' : 'no', 'list_index' : True})
+        header = self.read_output('smoke.h')
+        source = self.read_output('smoke.c')
+        self.assertTrue('} xcb_smoke_item_index_t;' in header)
+        for name in ('xcb_smoke_item_index_build', 'xcb_smoke_item_index_free',
+                     'xcb_smoke_item_at', 'xcb_smoke_item_bsearch'):
+            self.assertTrue('\n%s (' % name in source, name)
+
+    def test_collision(self):
+        # the type ItemIndex takes the name of the index type
+        xml = self.write_xml('smoke.xml', _smoke_xml.replace(
+            '<xidtype name="Thing" />',
+            '<xidtype name="Thing" />\n  <typedef oldname="CARD32" newname="ItemIndex" />'))
+        c_client.generate(xml, self.outdir, {'man' : 'no', 'list_index' : True})
+        header = self.read_output('smoke.h')
+        self.assertTrue('typedef uint32_t xcb_smoke_item_index_t;' in header)
+        self.assertFalse('} xcb_smoke_item_index_t;' in header)
+        self.assertFalse('xcb_smoke_item_bsearch' in header)
+
+_layout_xml = '''<?xml version="1.0" encoding="utf-8"?>
+<xcb header="smoke" extension-xname="SMOKE" extension-name="Smoke"
+     major-version="1" minor-version="0">
+  <enum name="Feature">
+    <item name="A"><bit>0</bit></item>
+  </enum>
+  <request name="GetMixed" opcode="0">
+    <reply>
+      <pad bytes="1" />
+      <field type="CARD32" name="present" mask="Feature" />
+      <field type="CARD16" name="name_len" />
+      <pad bytes="18" />
+      <list type="char" name="name"><fieldref>name_len</fieldref></list>
+      <switch name="details">
+        <fieldref>present</fieldref>
+        <bitcase><enumref ref="Feature">A</enumref>
+          <field type="CARD32" name="a" />
+        </bitcase>
+      </switch>
+    </reply>
+  </request>
+  <event name="Big" number="0" xge="true">
+    <field type="CARD16" name="name_len" />
+    <pad bytes="2" />
+    <list type="char" name="name"><fieldref>name_len</fieldref></list>
+    <list type="CARD32" name="values"><fieldref>name_len</fieldref></list>
+  </event>
+</xcb>
+'''
+
+class LayoutTest(GeneratorTestCase):
+    def test_layout(self):
+        xml = self.write_xml('smoke.xml', _layout_xml)
+        c_client.generate(xml, self.outdir, {'man' : 'no'})
+        header = self.read_output('smoke.h')
+        source = self.read_output('smoke.c')
+        # a switch after a list is pointed to
+        self.assertTrue('} xcb_smoke_get_mixed_reply_layout_t;' in header)
+        self.assertTrue('    layout->details = (void *) ((char *) name_end.data' in source)
+        # the name of an event layout comes from its C type
+        self.assertTrue('} xcb_smoke_big_event_layout_t;' in header)
+        self.assertTrue('\nxcb_smoke_big_event_layout (' in source)
+
+    def test_collision(self):
+        # the type GetMixedReplyLayout takes the name of the layout type
+        xml = self.write_xml('smoke.xml', _layout_xml.replace(
+            '<request name="GetMixed"',
+            '<typedef oldname="CARD32" newname="GetMixedReplyLayout" />\n  <request name="GetMixed"'))
+        c_client.generate(xml, self.outdir, {'man' : 'no'})
+        header = self.read_output('smoke.h')
+        self.assertTrue('typedef uint32_t xcb_smoke_get_mixed_reply_layout_t;' in header)
+        self.assertFalse('xcb_smoke_get_mixed_reply_layout (' in header)
+        self.assertTrue('} xcb_smoke_big_event_layout_t;' in header)
+
+_base_xml = '''<?xml version="1.0" encoding="utf-8"?>
+<xcb header="base">
+  <xidtype name="Thing" />
+  <struct name="Pair">
+    <field type="CARD16" name="a" />
+    <field type="CARD16" name="b" />
+  </struct>
+</xcb>
+'''
+
+_importing_xml = '''<?xml version="1.0" encoding="utf-8"?>
+<xcb header="smoke" extension-xname="SMOKE" extension-name="Smoke"
+     major-version="1" minor-version="0">
+  <import>base</import>
+  <request name="SetPair" opcode="0">
+    <field type="Thing" name="thing" />
+    <field type="Pair" name="pair" />
+  </request>
+</xcb>
+'''
+
+class CacheTest(GeneratorTestCase):
+    def setUp(self):
+        GeneratorTestCase.setUp(self)
+        self.write_xml('base.xml', _base_xml)
+        self.xml = self.write_xml('smoke.xml', _importing_xml)
+        self.cache_dir = os.path.join(self.tmpdir, 'cache')
+
+    def cache_files(self, prefix):
+        return [name for name in os.listdir(self.cache_dir)
+                if name.startswith(prefix + '-') and name.endswith('.pickle')]
+
+    def test_per_module(self):
+        c_client.generate(self.xml, self.outdir, {'man' : 'no', 'cache_dir' : self.cache_dir})
+        expected = self.read_output('smoke.c')
+        self.assertEqual(len(self.cache_files('base')), 1)
+        self.assertEqual(len(self.cache_files('smoke')), 1)
+
+        # loaded from the cache, the imported types are those of the
+        # imported module
+        cache = c_client._ModuleCache(self.cache_dir)
+        module = cache.load(self.xml)
+        base = cache.get(self.cache_files('base')[0][:-len('.pickle')])
+        self.assertTrue(module.types['base:Pair'][1] is base.types['base:Pair'][1])
+        self.assertTrue(module.types['base:Thing'][1] is c_client.tcard32)
+        self.assertEqual(module.imports, [('base', 'base')])
+
+        shutil.rmtree(self.outdir)
+        os.remove(os.path.join(self.cache_dir, 'smoke-lib.stamp'))
+        c_client.generate(self.xml, self.outdir, {'man' : 'no', 'cache_dir' : self.cache_dir})
+        self.assertEqual(self.read_output('smoke.c'), expected)
+
+    def test_matcher_untouched(self):
+        # the imports are handled without replacing the handler of xcbgen
+        funcs = sys.modules['xcbgen.matcher'].funcs
+        (import_, request) = (funcs['import'], funcs['request'])
+        seen = []
+        def record(node, module, namespace):
+            seen.append(funcs['import'])
+            return request(node, module, namespace)
+        funcs['request'] = record
+        try:
+            c_client.generate(self.xml, self.outdir, {'man' : 'no', 'cache_dir' : self.cache_dir})
+        finally:
+            funcs['request'] = request
+        self.assertEqual(seen, [import_])
+        self.assertTrue(funcs['import'] is import_)
+
+    def test_write_failure(self):
+        def fail(*args, **kwargs):
+            raise OSError(errno.ENOSPC, 'No space left on device')
+        messages = []
+        class Stderr(object):
+            def write(self, text):
+                messages.append(text)
+        (mkstemp, stderr) = (tempfile.mkstemp, sys.stderr)
+        (tempfile.mkstemp, sys.stderr) = (fail, Stderr())
+        try:
+            c_client.generate(self.xml, self.outdir, {'man' : 'no', 'cache_dir' : self.cache_dir})
+        finally:
+            (tempfile.mkstemp, sys.stderr) = (mkstemp, stderr)
+        self.assertTrue('xcb_smoke_set_pair' in self.read_output('smoke.h'))
+        self.assertTrue('Cannot cache module' in ''.join(messages))
+        self.assertTrue('Cannot write cache stamp' in ''.join(messages))
+        self.assertEqual(os.listdir(self.cache_dir), [])
+
+class MemoTest(GeneratorTestCase):
+    def setUp(self):
+        GeneratorTestCase.setUp(self)
+        self.write_xml('base.xml', _base_xml)
+        self.xml = self.write_xml('smoke.xml', _importing_xml)
+        c_client._module_memo = {}
+        # base names of the XML files parsed and resolved
+        self.built = []
+        self.build = c_client._ModuleCache.__dict__['build']
+        def build(cache, xml, name):
+            self.built.append(os.path.basename(xml))
+            return self.build(cache, xml, name)
+        c_client._ModuleCache.build = build
+
+    def tearDown(self):
+        c_client._ModuleCache.build = self.build
+        c_client._module_memo = None
+        GeneratorTestCase.tearDown(self)
+
+    def test_imports(self):
+        c_client._ModuleCache(None).load(self.xml)
+        self.assertEqual(sorted(self.built), ['base.xml', 'smoke.xml'])
+        del self.built[:]
+
+        # unchanged: nothing is parsed again
+        c_client._ModuleCache(None).load(self.xml)
+        self.assertEqual(self.built, [])
+
+        # only the changed module is parsed again, not its import
+        self.write_xml('smoke.xml', _importing_xml.replace('SetPair', 'PutPair'))
+        module = c_client._ModuleCache(None).load(self.xml)
+        self.assertEqual(self.built, ['smoke.xml'])
+        self.assertTrue(module.types['base:Thing'][1] is c_client.tcard32)
+        self.assertEqual(sorted(name.split('-')[0] for name in c_client._module_memo),
+                         ['base', 'smoke'])
+
+class _Namespace(object):
+    '''
+    Stands in for the xcbgen namespace of a module that is not an extension.
+    '''
+    is_ext = False
+    header = 'smoke'
+    file = 'smoke.xml'
+
+class ContextTestCase(unittest.TestCase):
+    '''
+    Base class of the tests that call the generator functions directly,
+    with a fresh context and namespace.
+    '''
+    def setUp(self):
+        self.saved = (c_client._ctx, c_client._ns)
+        self.tmpdir = tempfile.mkdtemp(prefix='test_c_client')
+        c_client._ctx = c_client.GenContext(self.tmpdir, dict(c_client.default_options))
+        c_client._ns = _Namespace()
+
+    def tearDown(self):
+        (c_client._ctx, c_client._ns) = self.saved
+        shutil.rmtree(self.tmpdir, True)
+
+    def read_output(self, name):
+        with open(os.path.join(self.tmpdir, name)) as f:
+            return f.read()
+
+class TypeSetupTest(ContextTestCase):
+    def test_names(self):
+        if not have_xcbgen:
+            self.skipTest('xcbgen is not available')
+        simple = c_client.SimpleType(('uint32_t',), 4)
+        for name in ('A', 'B', 'A'):
+            c_client._c_type_setup(simple, ('xcb', name), ())
+            self.assertEqual(simple.c_type, 'xcb_%s_t' % name.lower())
+
+class WriterTest(ContextTestCase):
+    def test_section_writer(self):
+        writer = c_client.SectionWriter('smoke.h')
+        writer.setlevel(2)
+        writer.write_line('two')
+        writer.setlevel(0)
+        writer.write_line('zero')
+        writer.setlevel(1)
+        writer.write_line('one')
+        writer.close()
+        self.assertEqual(self.read_output('smoke.h'), 'zero\none\ntwo\n')
+        self.assertEqual(os.listdir(self.tmpdir), ['smoke.h'])
+
+    def test_sharded_writer(self):
+        writer = c_client.ShardedWriter('smoke', 2)
+        writer.setlevel(0)
+        writer.write_line('#include "xcbext.h"')
+        writer.setlevel(1)
+        for (group, kind, line) in [(1, 'global', 'int global;'),
+                                    (2, 'request', 'void big (void) { /* long */ }'),
+                                    (2, 'reply', 'void big_reply (void) {}'),
+                                    (3, 'request', 'void small (void) {}')]:
+            c_client._ctx.function_group = group
+            writer.select(kind)
+            writer.write_line(line)
+        writer.close()
+
+        priv = self.read_output('smoke_priv.h')
+        self.assertTrue('#include "xcbext.h"' in priv)
+        self.assertTrue(priv.endswith('#endif\n'))
+        first = self.read_output('smoke.c')
+        second = self.read_output('smoke_1.c')
+        # the functions of one element stay together, the next element
+        # goes to the smallest shard
+        self.assertTrue('#include "smoke_priv.h"' in first)
+        self.assertTrue('int global;' in first)
+        self.assertTrue('void big ' in second and 'void big_reply ' in second)
+        self.assertTrue('void small ' in first)
+
+    def test_sharded_by_kind(self):
+        writer = c_client.ShardedWriter('smoke', 'kind')
+        writer.setlevel(1)
+        for (kind, line) in [('request', 'void request (void) {}'),
+                             ('serialize', 'int serialize (void) {}'),
+                             ('accessor', 'int accessor (void) {}')]:
+            writer.select(kind)
+            writer.write_line(line)
+        writer.close()
+        self.assertTrue('void request ' in self.read_output('smoke.c'))
+        self.assertTrue('int serialize ' in self.read_output('smoke_serialize.c'))
+        self.assertTrue('int accessor ' in self.read_output('smoke_accessors.c'))
+
+    def test_lean_header_writer(self):
+        writer = c_client.LeanHeaderWriter('smoke')
+        for line in ['/**', ' * @brief A struct', ' **/', 'typedef struct {',
+                     '    int a; /**< the a */', '} s_t;', '', '/** one line */', '',
+                     'void f (void);']:
+            writer.write_line(line)
+        writer.close()
+        self.assertEqual(self.read_output('smoke.h'),
+                         'typedef struct {\n    int a;\n} s_t;\n\nvoid f (void);\n')
+        doc = self.read_output('smoke-doc.h')
+        self.assertTrue(' * @brief A struct\n' in doc)
+        self.assertTrue('/**< the a */' in doc)
+
+    def test_split_header_writer(self):
+        writer = c_client.SplitHeaderWriter('smoke', ['xproto'])
+        writer.setlevel(1)
+        writer.write_line('preamble')
+        c_client._ctx.header_category = 'types'
+        writer.write_line('typedef int smoke_t;')
+        c_client._ctx.header_category = 'requests'
+        writer.write_line('void request (void);')
+        writer.close()
+
+        umbrella = self.read_output('smoke.h')
+        self.assertTrue('preamble' in umbrella)
+        for category in c_client.SplitHeaderWriter.categories:
+            self.assertTrue('#include "smoke_%s.h"' % category in umbrella)
+        types = self.read_output('smoke_types.h')
+        self.assertTrue('typedef int smoke_t;' in types)
+        # only the declarations the category headers need, not all of xcb.h
+        # and xproto.h
+        self.assertTrue('#include "xcb_base.h"' in types)
+        self.assertTrue('#include "xproto_types.h"' in types)
+        self.assertFalse('#include "xcb.h"' in types)
+        self.assertFalse('#include "xproto.h"' in types)
+        requests = self.read_output('smoke_requests.h')
+        self.assertTrue('void request (void);' in requests)
+        self.assertTrue('#include "smoke_errors.h"' in requests)
+        self.assertFalse('#include "xcb_base.h"' in requests)
+
+    def test_header_only_writer(self):
+        writer = c_client.HeaderOnlyWriter('smoke')
+        source = writer.source
+        writer.setlevel(1)
+        source.setlevel(1)
+        source.select('request')
+        writer.write_line('void request (void);')
+        source.write_line('void request (void)')
+        source.write_line('{}')
+        source.select('global')
+        source.write_line('xcb_extension_t xcb_smoke_id;')
+        source.select('request')
+        source.write_line('void other (void) {}')
+        writer.close()
+
+        header = self.read_output('smoke.h')
+        self.assertTrue('XCB_SMOKE_FUNCTION void request (void);\n' in header)
+        self.assertTrue('XCB_SMOKE_FUNCTION void request (void)\n{}\n' in header)
+        # the global exists only once, in the implementation
+        self.assertTrue('#ifdef XCB_SMOKE_IMPLEMENTATION\nxcb_extension_t xcb_smoke_id;\n'
+                        '\n#endif' in header)
+        self.assertTrue('XCB_SMOKE_FUNCTION void other (void) {}' in header)
+        self.assertFalse(os.path.exists(os.path.join(self.tmpdir, 'smoke.c')))
+
+class NameBlobTest(unittest.TestCase):
+    def test_offsets(self):
+        blob = c_client._NameBlob('names')
+        for name in ('Foo', 'Bar', 'Foo'):
+            blob.add(name)
+        # offset 0 is the empty string
+        self.assertEqual(blob['Foo'], 1)
+        self.assertEqual(blob['Bar'], 5)
+        self.assertEqual(blob.names, ['Foo', 'Bar'])
+        self.assertEqual(blob.size, 9)
+        self.assertEqual(blob.ctype, 'uint16_t')
+
+    def test_large(self):
+        blob = c_client._NameBlob('names')
+        for i in range(0x10000 // 8):
+            blob.add('Name%04d' % i)
+        self.assertEqual(blob.ctype, 'uint32_t')
+
+class ListFileTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix='test_c_client')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir, True)
+
+    def write(self, text):
+        path = os.path.join(self.tmpdir, 'list.txt')
+        with open(path, 'w') as f:
+            f.write(text)
+        return path
+
+    def test_manifest(self):
+        path = self.write('# used by the application\n'
+                          '0000000000001234 T xcb_get_geometry_reply\n'
+                          '\n'
+                          'xcb_intern_atom  # comment\n')
+        self.assertEqual(c_client.read_manifest(path),
+                         ['xcb_get_geometry_reply', 'xcb_intern_atom'])
+
+    def test_hot_list(self):
+        path = self.write('xcb_get_geometry*\n'
+                          '! xcb_*_sizeof  # rarely used\n'
+                          '# comment\n')
+        self.assertEqual(c_client.read_hot_list(path),
+                         [('xcb_get_geometry*', 'hot'), ('xcb_*_sizeof', 'cold')])
+
+class DecoratorTest(ContextTestCase):
+    def test_function_group(self):
+        @c_client._function_group
+        def handler(self, name, flag=False):
+            return (c_client._ctx.element, flag)
+        self.assertEqual(handler(None, ('xcb', 'GetItems'), flag=True), ('xcb_get_items', True))
+        self.assertEqual(c_client._ctx.function_group, 1)
+        handler(None, ('xcb', 'SetValue'))
+        self.assertEqual(c_client._ctx.function_group, 2)
+
+    def test_header_category(self):
+        @c_client._header_category('events')
+        def handler(fail=False):
+            if fail:
+                raise _Failure()
+            return c_client._ctx.header_category
+        c_client._ctx.header_category = 'types'
+        self.assertEqual(handler(), 'events')
+        self.assertEqual(c_client._ctx.header_category, 'types')
+        self.assertRaises(_Failure, handler, fail=True)
+        self.assertEqual(c_client._ctx.header_category, 'types')
+
+    def test_profiled(self):
+        class Element(object):
+            name = ('xcb', 'GetItems')
+        @c_client._profiled
+        def handler(element, depth=0):
+            if depth:
+                handler(element, depth=depth - 1)
+            return depth
+        self.assertEqual(handler(Element(), depth=1), 1)
+        c_client._ctx.profiler = c_client.Profiler()
+        self.assertEqual(handler(Element(), depth=1), 1)
+        record = c_client._ctx.profiler.records[('handler', 'xcb.GetItems')]
+        # two calls, the recursive one is timed by the outer one
+        self.assertEqual(record[0], 2)
+
+class SelectSubsetTest(unittest.TestCase):
+    def setUp(self):
+        if not have_xcbgen:
+            self.skipTest('xcbgen is not available')
+        self.tmpdir = tempfile.mkdtemp(prefix='test_c_client')
+        self.saved = c_client._ns
+        xml = os.path.join(self.tmpdir, 'smoke.xml')
+        with open(xml, 'w') as f:
+            f.write(_smoke_xml)
+        self.module = c_client.Module(xml, c_client.output)
+        self.module.register()
+        self.module.resolve()
+        c_client._ns = self.module.namespace
+
+    def tearDown(self):
+        c_client._ns = self.saved
+        shutil.rmtree(self.tmpdir, True)
+
+    def names(self):
+        return [name[-1] for (name, item) in self.module.all]
+
+    def test_symbol(self):
+        # a C identifier selects the element with the longest matching name,
+        # and the types it uses come along
+        c_client.select_subset(self.module, ['xcb_smoke_get_items_reply'])
+        self.assertEqual(self.names(), ['Item', 'GetItems'])
+
+    def test_xml_name(self):
+        c_client.select_subset(self.module, ['Changed', 'BadItem', 'xcb_other_thing'])
+        self.assertEqual(self.names(), ['Changed', 'BadItem'])
+
+if __name__ == '__main__':
+    unittest.main()
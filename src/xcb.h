@@ -27,21 +27,7 @@
 
 #ifndef __XCB_H__
 #define __XCB_H__
-#include <sys/types.h>
-
-#if defined(__solaris__)
-#include <inttypes.h>
-#else
-#include <stdint.h>
-#endif
-
-#ifndef _WIN32
-#include <sys/uio.h>
-#else
-#include "xcb_windefs.h"
-#endif
-#include <pthread.h>
-
+#include "xcb_base.h"
 
 #ifdef __cplusplus
 extern "C" {
@@ -51,8 +37,6 @@ extern "C" {
  * @file xcb.h
  */
 
-#define XCB_PACKED __attribute__((__packed__))
-
 /**
  * @defgroup XCB_Core_API XCB Core API
  * @brief Core API of the XCB library.
@@ -92,114 +76,6 @@ extern "C" {
 /** Connection closed because some FD passing operation failed */
 #define XCB_CONN_CLOSED_FDPASSING_FAILED 7
 
-#define XCB_TYPE_PAD(T,I) (-(I) & (sizeof(T) > 4 ? 3 : sizeof(T) - 1))
-
-/* Opaque structures */
-
-/**
- * @brief XCB Connection structure.
- *
- * A structure that contain all data that  XCB needs to communicate with an X server.
- */
-typedef struct xcb_connection_t xcb_connection_t;  /**< Opaque structure containing all data that  XCB needs to communicate with an X server. */
-
-
-/* Other types */
-
-/**
- * @brief Generic iterator.
- *
- * A generic iterator structure.
- */
-typedef struct {
-    void *data;   /**< Data of the current iterator */
-    int rem;    /**< remaining elements */
-    int index;  /**< index of the current iterator */
-} xcb_generic_iterator_t;
-
-/**
- * @brief Generic reply.
- *
- * A generic reply structure.
- */
-typedef struct {
-    uint8_t   response_type;  /**< Type of the response */
-    uint8_t  pad0;           /**< Padding */
-    uint16_t sequence;       /**< Sequence number */
-    uint32_t length;         /**< Length of the response */
-} xcb_generic_reply_t;
-
-/**
- * @brief Generic event.
- *
- * A generic event structure.
- */
-typedef struct {
-    uint8_t   response_type;  /**< Type of the response */
-    uint8_t  pad0;           /**< Padding */
-    uint16_t sequence;       /**< Sequence number */
-    uint32_t pad[7];         /**< Padding */
-    uint32_t full_sequence;  /**< full sequence */
-} xcb_generic_event_t;
-
-/**
- * @brief Raw Generic event.
- *
- * A generic event structure as used on the wire, i.e., without the full_sequence field
- */
-typedef struct {
-    uint8_t   response_type;  /**< Type of the response */
-    uint8_t  pad0;           /**< Padding */
-    uint16_t sequence;       /**< Sequence number */
-    uint32_t pad[7];         /**< Padding */
-} xcb_raw_generic_event_t;
-
-/**
- * @brief GE event
- *
- * An event as sent by the XGE extension. The length field specifies the
- * number of 4-byte blocks trailing the struct.
- *
- * @deprecated Since some fields in this struct have unfortunate names, it is
- * recommended to use xcb_ge_generic_event_t instead.
- */
-typedef struct {
-    uint8_t  response_type;  /**< Type of the response */
-    uint8_t  pad0;           /**< Padding */
-    uint16_t sequence;       /**< Sequence number */
-    uint32_t length;
-    uint16_t event_type;
-    uint16_t pad1;
-    uint32_t pad[5];         /**< Padding */
-    uint32_t full_sequence;  /**< full sequence */
-} xcb_ge_event_t;
-
-/**
- * @brief Generic error.
- *
- * A generic error structure.
- */
-typedef struct {
-    uint8_t   response_type;  /**< Type of the response */
-    uint8_t   error_code;     /**< Error code */
-    uint16_t sequence;       /**< Sequence number */
-    uint32_t resource_id;     /** < Resource ID for requests with side effects only */
-    uint16_t minor_code;      /** < Minor opcode of the failed request */
-    uint8_t major_code;       /** < Major opcode of the failed request */
-    uint8_t pad0;
-    uint32_t pad[5];         /**< Padding */
-    uint32_t full_sequence;  /**< full sequence */
-} xcb_generic_error_t;
-
-/**
- * @brief Generic cookie.
- *
- * A generic cookie structure.
- */
-typedef struct {
-    unsigned int sequence;  /**< Sequence number */
-} xcb_void_cookie_t;
-
 
 /* Include the generated xproto header. */
 #include "xproto.h"
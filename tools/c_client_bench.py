@@ -0,0 +1,264 @@
+#!/usr/bin/env python
+'''
+Scaling benchmark for src/c_client.py.
+
+Runs the generator on the real xcb-proto modules and on synthetic protocol
+descriptions of increasing size, and reports wall time and peak memory of
+every run.  The "growth" column is the time per unit of size relative to
+the smallest input of the same family; values well above 1 at the larger
+sizes point to superlinear behavior in the generator.
+'''
+from __future__ import print_function
+import getopt
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+_c_client = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                         os.pardir, 'src', 'c_client.py')
+
+def _xml_header(name, out):
+    out.append('<?xml version="1.0" encoding="utf-8"?>')
+    out.append('<xcb header="%s" extension-xname="%s" extension-name="%s"'
+               ' major-version="1" minor-version="0">' % (name, name.upper(), name.capitalize()))
+
+def synth_requests(size):
+    '''
+    size requests, each with fixed fields, a variable-size list and a reply.
+    Every request gets an opcode of its own, as in a real module, even
+    though those above 255 do not fit into the protocol; the generated
+    code is only measured, not compiled.
+    '''
+    out = []
+    _xml_header('benchreq', out)
+    for i in range(size):
+        out.append('<request name="Request%d" opcode="%d">' % (i, i))
+        out.append('  <field type="CARD32" name="window" />')
+        out.append('  <field type="CARD16" name="count" />')
+        out.append('  <pad bytes="2" />')
+        out.append('  <list type="CARD32" name="values"><fieldref>count</fieldref></list>')
+        out.append('  <reply>')
+        out.append('    <pad bytes="1" />')
+        out.append('    <field type="CARD32" name="length_out" />')
+        out.append('    <pad bytes="20" />')
+        out.append('    <list type="CARD8" name="data"><fieldref>length_out</fieldref></list>')
+        out.append('  </reply>')
+        out.append('</request>')
+    out.append('</xcb>')
+    return out
+
+def synth_switch(size):
+    '''
+    One request with switches nested size levels deep.  Every level
+    switches on a mask field of its own, in the bitcase of the level
+    around it: a bitcase cannot refer to the fields outside of it.
+    '''
+    out = []
+    _xml_header('benchswitch', out)
+    out.append('<enum name="Mask">')
+    for i in range(32):
+        out.append('  <item name="Bit%d"><bit>%d</bit></item>' % (i, i))
+    out.append('</enum>')
+    out.append('<request name="Nested" opcode="0">')
+    out.append('  <field type="CARD32" name="mask0" mask="Mask" />')
+    for i in range(size):
+        out.append('  <switch name="level%d"><fieldref>mask%d</fieldref>' % (i, i))
+        out.append('    <bitcase><enumref ref="Mask">Bit%d</enumref>' % (i % 32))
+        out.append('      <field type="CARD32" name="value%d" />' % i)
+        if i + 1 < size:
+            out.append('      <field type="CARD32" name="mask%d" mask="Mask" />' % (i + 1))
+    for i in range(size):
+        out.append('    </bitcase>')
+        out.append('  </switch>')
+    out.append('</request>')
+    out.append('</xcb>')
+    return out
+
+def synth_chain(size):
+    '''
+    One struct with size variable-size lists in a row, used by a request.
+    '''
+    out = []
+    _xml_header('benchchain', out)
+    out.append('<struct name="Chain">')
+    for i in range(size):
+        out.append('  <field type="CARD16" name="len%d" />' % i)
+    if size % 2:
+        out.append('  <pad bytes="2" />')
+    for i in range(size):
+        out.append('  <list type="CARD8" name="data%d"><fieldref>len%d</fieldref></list>' % (i, i))
+        out.append('  <pad align="4" />')
+        out.append('  <field type="CARD32" name="after%d" />' % i)
+    out.append('</struct>')
+    out.append('<request name="SetChain" opcode="0">')
+    out.append('  <field type="Chain" name="chain" />')
+    out.append('</request>')
+    out.append('</xcb>')
+    return out
+
+def synth_enum(size):
+    '''
+    One enum with size items, used by a request.
+    '''
+    out = []
+    _xml_header('benchenum', out)
+    out.append('<enum name="Big">')
+    for i in range(size):
+        out.append('  <item name="Item%d"><value>%d</value></item>' % (i, i))
+    out.append('</enum>')
+    out.append('<request name="SetBig" opcode="0">')
+    out.append('  <field type="CARD32" name="value" enum="Big" />')
+    out.append('</request>')
+    out.append('</xcb>')
+    return out
+
+# family -> (generator function, sizes)
+families = {'requests' : (synth_requests, [100, 300, 1000, 3000, 10000]),
+            'switch'   : (synth_switch, [2, 4, 8, 16, 32]),
+            'chain'    : (synth_chain, [10, 30, 100, 300, 1000]),
+            'enum'     : (synth_enum, [100, 1000, 10000, 100000]),
+            }
+
+def run_generator(xml, outdir, xcbgen_path):
+    '''
+    Runs c_client.py on xml in a child process.  Returns the wall time in
+    seconds and the peak resident set size of the child in KiB.
+    '''
+    cmd = [sys.executable, _c_client, '-j', '1', '-o', outdir]
+    if xcbgen_path is not None:
+        cmd += ['-p', xcbgen_path]
+    cmd.append(xml)
+
+    start = time.time()
+    child = subprocess.Popen(cmd)
+    (pid, status, rusage) = os.wait4(child.pid, 0)
+    seconds = time.time() - start
+    # Reaped already, keep Popen from waiting for it again.  status is the
+    # raw wait status, decode it the way Popen does.
+    if os.WIFSIGNALED(status):
+        child.returncode = -os.WTERMSIG(status)
+    else:
+        child.returncode = os.WEXITSTATUS(status)
+    if child.returncode < 0:
+        raise RuntimeError('%s killed by signal %d' % (' '.join(cmd), -child.returncode))
+    if child.returncode != 0:
+        raise RuntimeError('%s failed with status %d' % (' '.join(cmd), child.returncode))
+    return (seconds, rusage.ru_maxrss)
+
+def bench(name, size, xml, workdir, xcbgen_path, repeat):
+    '''
+    Runs the generator repeat times on xml and returns the result of the
+    fastest run as dict.  If a run fails, the result has the error message
+    instead of the time and memory.
+    '''
+    outdir = os.path.join(workdir, 'out')
+    best = None
+    try:
+        for i in range(repeat):
+            # Always start from scratch, so every run generates everything
+            shutil.rmtree(outdir, True)
+            result = run_generator(xml, outdir, xcbgen_path)
+            if best is None or result[0] < best[0]:
+                best = result
+    except RuntimeError as e:
+        print(e, file=sys.stderr)
+        return {'family' : name,
+                'size' : size,
+                'error' : str(e)}
+    return {'family' : name,
+            'size' : size,
+            'seconds' : best[0],
+            'peak_kib' : best[1]}
+
+def print_results(results, out=sys.stdout):
+    row = '%-24s %8s %10s %10s %8s\n'
+    out.write(row % ('family', 'size', 'seconds', 'peak MiB', 'growth'))
+    base = {}
+    for r in results:
+        family = r['family']
+        if 'module' in r:
+            family += ':' + r['module']
+        if 'error' in r:
+            out.write(row % (family, r['size'], 'failed', '', ''))
+            continue
+        (size, seconds) = base.setdefault(r['family'], (r['size'], r['seconds']))
+        growth = ''
+        if seconds > 0:
+            growth = '%.2f' % ((r['seconds'] / seconds) / (float(r['size']) / size))
+        out.write(row % (family, r['size'], '%.3f' % r['seconds'],
+                         '%.1f' % (r['peak_kib'] / 1024.0), growth))
+
+def usage():
+    print('Usage: c_client_bench.py [-p xcbgen_path] [-x xcb-proto/src] [-f family,...]'
+          ' [-r repeat] [--max-size n] [--json file]', file=sys.stderr)
+    sys.exit(1)
+
+def main(argv):
+    xcbgen_path = None
+    proto_dir = None
+    selected = sorted(families)
+    repeat = 1
+    max_size = None
+    json_path = None
+
+    try:
+        opts, args = getopt.getopt(argv, 'p:x:f:r:', ['max-size=', 'json='])
+    except getopt.GetoptError as err:
+        print(err, file=sys.stderr)
+        usage()
+    if args:
+        usage()
+
+    for (opt, arg) in opts:
+        if opt == '-p':
+            xcbgen_path = os.path.abspath(arg)
+        if opt == '-x':
+            proto_dir = arg
+        if opt == '-f':
+            selected = arg.split(',')
+        if opt == '-r':
+            repeat = int(arg)
+        if opt == '--max-size':
+            max_size = int(arg)
+        if opt == '--json':
+            json_path = arg
+
+    workdir = tempfile.mkdtemp(prefix='c_client_bench')
+    results = []
+    try:
+        if proto_dir is not None:
+            # Sized by file size, smallest first
+            xmls = [os.path.join(proto_dir, name)
+                    for name in os.listdir(proto_dir) if name.endswith('.xml')]
+            for xml in sorted(xmls, key=os.path.getsize):
+                result = bench('xcb-proto', os.path.getsize(xml), xml,
+                               workdir, xcbgen_path, repeat)
+                result['module'] = os.path.basename(xml)[:-4]
+                results.append(result)
+
+        for name in selected:
+            if name not in families:
+                print('Unknown family %s' % name, file=sys.stderr)
+                usage()
+            (synth, sizes) = families[name]
+            for size in sizes:
+                if max_size is not None and size > max_size:
+                    continue
+                xml = os.path.join(workdir, 'bench%s.xml' % name)
+                with open(xml, 'w') as f:
+                    f.write('\n'.join(synth(size)) + '\n')
+                results.append(bench(name, size, xml, workdir, xcbgen_path, repeat))
+    finally:
+        shutil.rmtree(workdir, True)
+
+    print_results(results)
+    if json_path is not None:
+        with open(json_path, 'w') as f:
+            json.dump(results, f, indent=1, sort_keys=True)
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
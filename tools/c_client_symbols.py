@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+'''
+Joins the symbol reports written by c_client.py --symbol-report with the
+symbol sizes of the compiled objects, as printed by nm -S.  Prints the
+protocol elements with the most code, and the accessors and iterators
+that are not constant time.
+'''
+from __future__ import print_function
+import getopt
+import subprocess
+import sys
+
+def read_reports(paths):
+    '''
+    Returns symbol -> (kind, element, lines, cost) from the report files.
+    '''
+    symbols = {}
+    for path in paths:
+        with open(path) as f:
+            for line in f:
+                if line.startswith('#'):
+                    continue
+                (symbol, kind, element, lines, cost) = line.rstrip('\n').split('\t')
+                symbols[symbol] = (kind, element, int(lines), cost)
+    return symbols
+
+def read_sizes(objects, nm='nm'):
+    '''
+    Returns symbol -> size in bytes of the code and data in objects.
+    '''
+    sizes = {}
+    output = subprocess.Popen([nm, '-S', '--defined-only'] + objects,
+                              stdout=subprocess.PIPE,
+                              universal_newlines=True).communicate()[0]
+    for line in output.splitlines():
+        words = line.split()
+        # value size type name
+        if len(words) == 4:
+            sizes[words[3]] = sizes.get(words[3], 0) + int(words[1], 16)
+    return sizes
+
+def usage():
+    print('Usage: c_client_symbols.py [-n top] [--nm nm] file.symbols... -- object...',
+          file=sys.stderr)
+    sys.exit(1)
+
+def main(argv):
+    top = 20
+    nm = 'nm'
+    try:
+        opts, args = getopt.getopt(argv, 'n:', ['nm='])
+    except getopt.GetoptError as err:
+        print(err, file=sys.stderr)
+        usage()
+    for (opt, arg) in opts:
+        if opt == '-n':
+            top = int(arg)
+        if opt == '--nm':
+            nm = arg
+    if '--' not in args:
+        usage()
+    split = args.index('--')
+    (reports, objects) = (args[:split], args[split + 1:])
+    if not reports or not objects:
+        usage()
+
+    symbols = read_reports(reports)
+    sizes = read_sizes(objects, nm)
+
+    elements = {}
+    for (symbol, (kind, element, lines, cost)) in symbols.items():
+        total = elements.setdefault(element, [0, 0, 0])
+        total[0] += 1
+        total[1] += lines
+        total[2] += sizes.get(symbol, 0)
+
+    row = '%-48s %9s %9s %9s\n'
+    sys.stdout.write('Protocol elements by code size:\n')
+    sys.stdout.write(row % ('element', 'functions', 'lines', 'bytes'))
+    for (element, total) in sorted(elements.items(), key=lambda item: -item[1][2])[:top]:
+        sys.stdout.write(row % (element or '-', total[0], total[1], total[2]))
+
+    row = '%-56s %-10s %-12s %9s\n'
+    sys.stdout.write('\nAccessors and iterators that are not constant time:\n')
+    sys.stdout.write(row % ('symbol', 'kind', 'cost', 'bytes'))
+    for symbol in sorted(symbols, key=lambda symbol: -sizes.get(symbol, 0)):
+        (kind, element, lines, cost) = symbols[symbol]
+        if kind in ('accessor', 'iterator') and cost != 'constant':
+            sys.stdout.write(row % (symbol, kind, cost, sizes.get(symbol, 0)))
+
+if __name__ == '__main__':
+    main(sys.argv[1:])